@@ -0,0 +1,130 @@
+"""
+Renders animations off-screen on all the cores of the machine.
+
+The frames are split between worker processes. Each worker builds its own scene, engine and renderer once,
+then renders the frames it is given and writes them as numbered PNG files, or sends them back as raw RGBA
+frames that are written in order to a stream.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib.image as mpimg
+import numpy as np
+from renderer import Renderer
+from engine import Engine3D, Entity
+from mesh import Mesh
+
+
+# State of a worker process, set up once by _init_worker
+_engine3d = None
+_renderer = None
+_camera_path = None
+
+
+def _init_worker(build_scene, camera_path, width, height, backend):
+    global _engine3d, _renderer, _camera_path
+    _renderer = Renderer(width=width, height=height, retained=True, backend=backend, headless=True)
+    _engine3d = build_scene()
+    _camera_path = camera_path
+
+
+def _render(frame, output):
+    position, direction = _camera_path(frame)
+    _engine3d.camera.position = position
+    _engine3d.camera.direction = direction
+    _engine3d.update(_renderer)
+    image = _renderer.render_frame()
+
+    if output is None:
+        # The frame is a view on the canvas buffer, tobytes() copies it before the next frame overwrites it
+        return image.tobytes()
+
+    path = output.format(frame)
+    mpimg.imsave(path, image)
+    return path
+
+
+def render_animation(
+    build_scene,
+    camera_path,
+    frames,
+    output="frames/frame_{:04d}.png",
+    stream=None,
+    width=200,
+    height=200,
+    backend="vector",
+    workers=None,
+):
+    """Renders the frames of an animation in parallel.
+
+    The functions given must be picklable (defined at the top level of a module) to be sent to the workers.
+
+    Args:
+        build_scene (function): Returns the Engine3D to render, with its entities. Called once per worker.
+        camera_path (function): Takes a frame number and returns the (position, direction) of the camera.
+        frames (range): The frames to render
+        output (str): Format string of the path of the PNG file of a frame, formatted with the frame number
+        stream (file): If given, the frames are written to this binary file as raw RGBA images, one after
+            the other in order, instead of being written as PNG files
+        width (int): Width of the renderer
+        height (int): Height of the renderer
+        backend (str): Backend of the renderer, "vector" or "raster"
+        workers (int): Number of worker processes, defaults to the number of cores
+
+    Returns:
+        list: The paths of the PNG files in the order of the frames, or None if the frames were streamed
+    """
+    frames = list(frames)
+    workers = workers or os.cpu_count()
+
+    if stream is None:
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    else:
+        output = None
+
+    # Frames are sent by chunks to limit the communication between the processes
+    chunksize = max(1, len(frames)//(workers*4))
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(build_scene, camera_path, width, height, backend),
+    ) as executor:
+        # map yields the results in the order of the frames, whatever the order in which they are rendered
+        results = executor.map(_render, frames, [output]*len(frames), chunksize=chunksize)
+
+        if stream is None:
+            return list(results)
+
+        for frame in results:
+            stream.write(frame)
+
+
+def turntable(frame, frames=600, radius=6, height=3, target=(0, 2, 0)):
+    """Camera path going once around the target in the given number of frames."""
+    angle = 2*np.pi*frame/frames
+    target = np.array(target, dtype=float)
+    position = target + np.array([radius*np.sin(angle), height - target[1], radius*np.cos(angle)])
+    return position, target - position
+
+
+def cat_scene():
+    engine3d = Engine3D()
+    engine3d.light_direction = [-1, -2, -1]
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Moving camera demo", "cat.obj")
+    cat = Entity(mesh=Mesh.load_from_file(path))
+    engine3d.add_entity(cat)
+    return engine3d
+
+
+def main():
+    # A 600 frames turntable of the cat, written in the frames folder
+    paths = render_animation(cat_scene, turntable, range(600))
+    print(f"Rendered {len(paths)} frames")
+
+
+if __name__ == "__main__":
+    main()
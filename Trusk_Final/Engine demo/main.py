@@ -56,6 +56,7 @@ def main():
         width=200,
         height=200,
         frame_time=0,
+        retained=True,
     )
 
     engine3d = Engine3D()
@@ -71,9 +72,9 @@ def main():
     engine3d.add_entity(cube)
 
     while True:
-        # engine3d.camera.position[1] += 0.1
+        # engine3d.camera.position = engine3d.camera.position + [0, 0.1, 0]
         engine3d.light_direction[0] += 0.1
-        cube.position[0] += 0.1
+        cube.position = cube.position + [0.1, 0, 0]
         engine3d.update(renderer)
         renderer.draw()
 
@@ -63,6 +63,14 @@ class Matrix4x4():
         result[3][2] = z
         return result
 
+    def scaling(x: float, y: float, z: float):
+        result = np.zeros((4, 4), dtype=float)
+        result[0][0] = x
+        result[1][1] = y
+        result[2][2] = z
+        result[3][3] = 1
+        return result
+
     def projection(fov: float, aspect_ratio: float, near: float, far: float):
         """
         Args:
@@ -106,4 +114,15 @@ class Matrix4x4():
         result[3][2] = pos[2]
         result[3][3] = 1
 
-        return result
\ No newline at end of file
+        return result
+
+    def quick_inverse(m):
+        """
+        Inverse of a matrix made of a rotation and a translation, like the ones returned by point_at.
+        The rotation is transposed and the translation is negated, instead of doing a general inverse.
+        """
+        result = np.zeros((4, 4), dtype=float)
+        result[:3, :3] = m[:3, :3].T
+        result[3, :3] = -m[3, :3] @ m[:3, :3].T
+        result[3][3] = 1
+        return result
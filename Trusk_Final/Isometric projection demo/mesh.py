@@ -0,0 +1,919 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+
+# Suffix of the folder next to an OBJ file in which its parsed mesh is cached
+CACHE_SUFFIX = ".cache"
+
+# Number of triangles in each block of a chunked mesh
+BLOCK_SIZE = 4096
+
+# Number of triangles in each leaf of a bounding volume hierarchy, smaller meshes have no hierarchy
+BVH_LEAF_SIZE = 256
+
+# Cost of splitting a triangle when choosing the plane of a node of a BSP tree, relative to the cost of having
+# one more triangle on one side of the plane than on the other
+SPLIT_COST = 8
+
+# Number of cells along the longest side of the bounding box for the most detailed level of detail of a mesh
+LOD_RESOLUTION = 128
+
+
+class Mesh():
+    def __init__(self, triangles=None, vertices=None, faces=None, normals=None, dtype=np.float64) -> None:
+        """A triangle mesh, along with data derived from its geometry.
+
+        The geometry is stored as indexed triangles: each vertex is stored once in vertices, and faces
+        holds the indices of the 3 vertices of each triangle. A mesh given as triangles is converted by
+        merging the vertices that are equal.
+        The face normals, centroids and bounding volumes are computed once, when the geometry is set.
+        The arrays are read-only: the geometry must be changed with set_geometry(), set_triangles() or
+        transform(), which compute the derived data again.
+        Simplified versions of the mesh, drawn instead of it when it is small on the screen, are made by
+        build_lods(). They are dropped when the geometry changes.
+        Large meshes also have a bounding volume hierarchy of their triangles, built on first use, which gives
+        the triangles in view and speeds up ray casting. Static meshes can be compiled into a BSP tree with
+        compile_bsp(), which gives their triangles from back to front without sorting them.
+
+        Args:
+            triangles (list): Triangles of shape (N, 3, 3) or (N, 3, 4)
+            vertices (list): Vertices of shape (V, 3) or (V, 4), used with faces instead of triangles
+            faces (list): Indices of the vertices of each triangle, of shape (N, 3)
+            normals (list): Normals of the faces of unit length, of shape (N, 3), computed if not given
+            dtype (type): Type of the vertices and normals, np.float32 halves the memory and speeds up the engine
+        """
+        self.dtype = np.dtype(dtype)
+        if vertices is not None:
+            self.set_geometry(vertices, faces, normals)
+        else:
+            self.set_triangles([] if triangles is None else triangles)
+
+    @property
+    def vertices(self):
+        return self._vertices
+
+    @property
+    def faces(self):
+        return self._faces
+
+    @property
+    def triangles(self):
+        """The vertices of each triangle, of shape (N, 3, 4). A new array is gathered at each call."""
+        return self._vertices[self._faces]
+
+    def set_geometry(self, vertices, faces, normals=None):
+        """Replaces the geometry of the mesh by indexed triangles.
+
+        The arrays are copied, unless they are read-only arrays of the right type (e.g. memory-mapped files).
+        """
+        vertices = _read_only(vertices, self.dtype)
+        if vertices.size == 0:
+            vertices = _read_only(np.empty((0, 4)), self.dtype)
+        faces = _read_only(faces, np.int32).reshape(-1, 3)
+
+        # Adding 4th dimension to all vectors
+        if vertices.shape[1] == 3:
+            vertices = _read_only(np.concatenate((vertices, np.ones((vertices.shape[0], 1))), axis=1), self.dtype)
+
+        self._vertices = vertices
+        self._faces = faces
+        self._compute_derived_data(None if normals is None else _read_only(normals, self.dtype))
+
+    def set_triangles(self, triangles):
+        """Replaces the geometry of the mesh by a list of triangles, the vertices they share are merged."""
+        triangles = np.array(triangles, dtype=self.dtype)
+        if triangles.size == 0:
+            self.set_geometry([], [])
+            return
+
+        vertices, faces = np.unique(triangles.reshape(-1, triangles.shape[2]), axis=0, return_inverse=True)
+        self.set_geometry(vertices, faces.reshape(-1, 3))
+
+    def transform(self, matrix):
+        """Applies a 4x4 transformation matrix to all the vertices of the mesh."""
+        self.set_geometry(self._vertices @ matrix, self._faces)
+
+    def astype(self, dtype):
+        """Returns a copy of the mesh and of its levels of detail with vertices and normals of another type."""
+        mesh = Mesh(vertices=self._vertices, faces=self._faces, normals=self.normals, dtype=dtype)
+        mesh.set_lods([lod.astype(dtype) for lod in self.lods], self.lod_cell_sizes)
+        mesh._bvh = self._bvh
+        return mesh
+
+    def decimate(self, cell_size):
+        """Returns a simplified copy of the mesh, made by vertex clustering.
+
+        Space is divided in cubes of the given size, and the vertices in each cube are merged into a single vertex
+        at their mean position. Triangles whose vertices end up in less than 3 cubes disappear.
+
+        Args:
+            cell_size (float): Size of the side of the cubes, the vertices move by less than its diagonal
+        """
+        # Index of the cube of each vertex, the cubes used are numbered from 0
+        cells = np.floor((self._vertices[:, :3] - self.aabb_min)/cell_size).astype(np.int64)
+        _, clusters = np.unique(cells, axis=0, return_inverse=True)
+        clusters = clusters.reshape(-1)
+        count = clusters.max() + 1 if len(clusters) > 0 else 0
+
+        sizes = np.bincount(clusters, minlength=count)
+        vertices = np.ones((count, 4))
+        for i in range(3):
+            vertices[:, i] = np.bincount(clusters, weights=self._vertices[:, i], minlength=count)/sizes
+
+        # Triangles that became a point, a line or a flat triangle are removed
+        faces = clusters[self._faces]
+        triangles = vertices[faces]
+        line1 = triangles[:, 1, :3] - triangles[:, 0, :3]
+        line2 = triangles[:, 2, :3] - triangles[:, 0, :3]
+        faces = faces[np.linalg.norm(np.cross(line1, line2), axis=1) > 0]
+
+        # Triangles merged into the same one are kept once. The smallest index is put first without changing the
+        # winding, so that the two sides of a thin wall are not merged.
+        first = np.argmin(faces, axis=1)[:, np.newaxis]
+        faces = np.take_along_axis(faces, (first + np.arange(3)) % 3, axis=1)
+        faces = np.unique(faces, axis=0)
+
+        return Mesh(vertices=vertices, faces=faces, dtype=self.dtype)
+
+    def build_lods(self, levels=3, resolution=LOD_RESOLUTION):
+        """Makes simplified versions of the mesh, each with cubes twice as large as the previous one.
+
+        Args:
+            levels (int): Number of levels of detail, without the mesh itself
+            resolution (int): Number of cubes along the longest side of the bounding box for the first level
+        """
+        size = (self.aabb_max - self.aabb_min).max()
+        cell_sizes = size/resolution*2.0**np.arange(levels) if size > 0 else np.zeros(0)
+        self.set_lods([self.decimate(cell_size) for cell_size in cell_sizes], cell_sizes)
+
+    def set_lods(self, lods, cell_sizes):
+        """Replaces the levels of detail of the mesh, from the most detailed to the simplest.
+
+        Args:
+            lods (list): Simplified meshes
+            cell_sizes (list): Size of the cubes used to simplify each mesh, in increasing order
+        """
+        self.lods = list(lods)
+        self.lod_cell_sizes = np.array(cell_sizes, dtype=float).reshape(-1)
+        self.lod_cell_sizes.flags.writeable = False
+
+    def level_of_detail(self, error):
+        """Returns the simplest version of the mesh whose vertices moved by less than about the given distance.
+
+        Args:
+            error (float): Distance in the space of the mesh, for example the size of a pixel on the screen
+        """
+        level = np.searchsorted(self.lod_cell_sizes, error, side='right')
+        return self if level == 0 else self.lods[level - 1]
+
+    @property
+    def bvh(self):
+        """Bounding volume hierarchy of the triangles, built on first use. None if the mesh fits in a single leaf."""
+        if self._bvh is None and len(self._faces) > BVH_LEAF_SIZE:
+            self._bvh = BoundingVolumeHierarchy.build(self._vertices, self._faces, BVH_LEAF_SIZE)
+        return self._bvh
+
+    @property
+    def bsp(self):
+        """BSP tree of the triangles made by compile_bsp(), or None."""
+        return self._bsp
+
+    def compile_bsp(self):
+        """Splits the triangles of the mesh so that they can be drawn from back to front from any point of view.
+
+        The geometry of the mesh is replaced by the split triangles, see BSPTree. This is slow and done once,
+        for meshes that don't change. It only pays off for small static meshes, like the cube of the isometric
+        demo: the triangles of large curved meshes are split many times (the 22k triangles of sample_13.obj
+        become 115k), and sorting the triangles of the mesh by depth is then faster than traversing the tree.
+        """
+        triangles = np.array(self.triangles, dtype=float)
+        bsp, triangles, normals = BSPTree.build(triangles, np.array(self.normals, dtype=float))
+        vertices, faces = np.unique(triangles.reshape(-1, 4), axis=0, return_inverse=True)
+        self.set_geometry(vertices, faces.reshape(-1, 3), normals)
+        self._bsp = bsp
+
+    @property
+    def centroids(self):
+        """Centers of the triangles, computed on first use."""
+        if self._centroids is None:
+            self._centroids = self.triangles[:, :, :3].mean(axis=1)
+            self._centroids.flags.writeable = False
+        return self._centroids
+
+    def _compute_derived_data(self, normals=None):
+        if normals is None:
+            normals = _face_normals(self.triangles)
+        self.normals = normals
+
+        self._centroids = None
+        self._bvh = None
+        self._bsp = None
+        self.set_lods([], [])
+
+        # Axis aligned bounding box, and bounding sphere centered on the box
+        points = self._vertices[:, :3]
+        if len(points) > 0:
+            self.aabb_min = points.min(axis=0)
+            self.aabb_max = points.max(axis=0)
+            self.center = (self.aabb_min + self.aabb_max)/2
+            self.radius = np.linalg.norm(points - self.center, axis=1).max()
+        else:
+            self.aabb_min = np.zeros(3)
+            self.aabb_max = np.zeros(3)
+            self.center = np.zeros(3)
+            self.radius = 0.
+
+        for array in (self.normals, self.aabb_min, self.aabb_max, self.center):
+            array.flags.writeable = False
+
+    def visible_parts(self, planes, eye=None):
+        """Yields the vertices, faces and normals of the parts of the mesh that can be visible, and the indices
+        of their faces in the mesh (an array or a slice).
+
+        The mesh is a single part, its bounding sphere is already tested by the engine. Only the triangles of
+        the leaves of the hierarchy that are not outside of the view are kept. The triangles of a mesh with a
+        BSP tree are all given, from back to front.
+
+        Args:
+            planes (ndarray): Planes of the view in the space of the mesh, of shape (P, 4)
+            eye (ndarray): Position of the camera in the space of the mesh in homogeneous coordinates, see
+                BSPTree.back_to_front()
+        """
+        if self._bsp is not None and eye is not None:
+            order = self._bsp.back_to_front(eye)
+            yield self._vertices, self._faces[order], self.normals[order], order
+            return
+
+        bvh = self.bvh
+        if bvh is None:
+            yield self._vertices, self._faces, self.normals, slice(None)
+            return
+
+        triangles = bvh.triangles(bvh.frustum_ranges(planes))
+        if len(triangles) == len(self._faces):
+            # The whole mesh is in view, the triangles don't need to be gathered
+            yield self._vertices, self._faces, self.normals, slice(None)
+        else:
+            yield self._vertices, self._faces[triangles], self.normals[triangles], triangles
+
+    def raycast(self, origin, direction):
+        """Returns the first triangle hit by a ray.
+
+        Args:
+            origin (list): Start of the ray
+            direction (list): Direction of the ray, the distance is measured in lengths of this vector
+
+        Returns:
+            tuple: The distance along the ray and the index of the triangle, or None if no triangle is hit
+        """
+        origin = np.array(origin, dtype=float)[:3]
+        direction = np.array(direction, dtype=float)[:3]
+        bvh = self.bvh
+        candidates = np.arange(len(self._faces)) if bvh is None else bvh.triangles(bvh.ray_ranges(origin, direction))
+
+        # Möller–Trumbore intersection of the ray with all the candidate triangles
+        triangles = self._vertices[self._faces[candidates]][:, :, :3].astype(float)
+        edge1 = triangles[:, 1] - triangles[:, 0]
+        edge2 = triangles[:, 2] - triangles[:, 0]
+        p = np.cross(direction, edge2)
+        determinants = np.einsum('ij,ij->i', edge1, p)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1/determinants
+            t = origin - triangles[:, 0]
+            u = np.einsum('ij,ij->i', t, p)*inverse
+            q = np.cross(t, edge1)
+            v = (q @ direction)*inverse
+            distances = np.einsum('ij,ij->i', q, edge2)*inverse
+        hits = np.flatnonzero((determinants != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (distances >= 0))
+        if len(hits) == 0:
+            return None
+        first = hits[np.argmin(distances[hits])]
+        return distances[first], candidates[first]
+
+    def load_from_file(path: str, cache=True, dtype=np.float64, lod_levels=0) -> None:
+        """Loads the vertices and the faces of an OBJ file.
+
+        The whole file is parsed at once with NumPy instead of line by line. Faces can have any number of
+        vertices, they are split in triangles sharing their first vertex. Texture coordinates and normals
+        of the faces (v/vt/vn) are ignored, as well as all the other records.
+
+        The parsed mesh is saved in binary next to the file, in a folder named after it with CACHE_SUFFIX.
+        The next loads of the same file map the saved arrays in memory instead of parsing the file again.
+        The hierarchy of the triangles and the levels of detail are cached in the same folder.
+
+        Args:
+            path (str): Path of the OBJ file
+            cache (bool): Whether to use and update the binary cache
+            dtype (type): Type of the vertices and normals of the mesh, the cache is always in double precision
+            lod_levels (int): Number of levels of detail made by build_lods()
+        """
+        mesh = _load_cache(path) if cache else None
+        if mesh is None:
+            mesh = Mesh._parse(path, cache)
+
+        if len(mesh.lods) < lod_levels:
+            mesh.build_lods(lod_levels)
+            if cache:
+                _save_lods(path, mesh)
+        mesh.set_lods(mesh.lods[:lod_levels], mesh.lod_cell_sizes[:lod_levels])
+
+        if mesh.dtype != dtype:
+            mesh = mesh.astype(dtype)
+        return mesh
+
+    def _parse(path, cache):
+        """Parses an OBJ file, see load_from_file()."""
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        buffer = np.frombuffer(data + b'\n', dtype=np.uint8)
+
+        # Lines of the file, the line feed belongs to the line it ends
+        line_ends = np.flatnonzero(buffer == ord('\n'))
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+        line_lengths = line_ends + 1 - line_starts
+
+        # The records we need are the lines starting with "v " and "f "
+        first = buffer[line_starts]
+        second = buffer[np.minimum(line_starts + 1, len(buffer) - 1)]
+        separated = (second == ord(' ')) | (second == ord('\t'))
+        vertex_lines = (first == ord('v')) & separated
+        face_lines = (first == ord('f')) & separated
+
+        positions, counts = _parse_records(buffer, line_starts, line_lengths, vertex_lines, float)
+        first_position = np.cumsum(counts) - counts
+        vertices = np.ones((len(counts), 4))
+        for i in range(3):
+            vertices[:, i] = positions[first_position + i]
+
+        indices, counts = _parse_records(buffer, line_starts, line_lengths, face_lines, np.int64)
+
+        # Indices start at 1, negative indices count back from the last vertex defined before the face
+        defined_vertices = np.cumsum(vertex_lines)[face_lines]
+        indices = np.where(indices < 0, indices + np.repeat(defined_vertices, counts), indices - 1)
+
+        # Fan triangulation: a face of k vertices gives the triangles (0, i, i + 1) for i in 1..k-2
+        triangles_per_face = np.maximum(counts - 2, 0)
+        face_start = np.repeat(np.cumsum(counts) - counts, triangles_per_face)
+        i = np.arange(len(face_start)) - np.repeat(np.cumsum(triangles_per_face) - triangles_per_face, triangles_per_face) + 1
+        faces = np.stack((indices[face_start], indices[face_start + i], indices[face_start + i + 1]), axis=1)
+
+        mesh = Mesh(vertices=vertices, faces=faces)
+        if cache:
+            source = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "bvh_leaf_size": BVH_LEAF_SIZE,
+            }
+            _save_cache(path, mesh, source)
+        return mesh
+
+
+class BoundingVolumeHierarchy():
+    def __init__(self, bounds, ranges, order) -> None:
+        """A binary tree of bounding boxes over the triangles of a mesh, stored in flat arrays.
+
+        The triangles are sorted along a Z-order curve of their centers and split in leaves of consecutive
+        triangles. The tree is complete: the root is node 1 and the children of node i are 2i and 2i + 1,
+        so the leaves are the last half of the nodes. Node 0 is not used.
+
+        Args:
+            bounds (ndarray): Bounding boxes of the nodes, of shape (K, 2, 3): the minimum then the maximum corner
+            ranges (ndarray): First and past the last sorted triangle of each node, of shape (K, 2)
+            order (ndarray): Index in the mesh of each sorted triangle, of shape (N,)
+        """
+        self.bounds = bounds
+        self.ranges = ranges
+        self.order = order
+        self.leaves = len(bounds)//2
+
+    def build(vertices, faces, leaf_size=BVH_LEAF_SIZE):
+        """Builds the hierarchy of the triangles of indexed vertices."""
+        points = np.asarray(vertices)[:, :3]
+        corners = [points[faces[:, i]] for i in range(3)]
+        order = np.argsort(_morton_codes((corners[0] + corners[1] + corners[2])/3), kind='stable')
+        triangle_min = np.minimum(np.minimum(corners[0], corners[1]), corners[2])[order]
+        triangle_max = np.maximum(np.maximum(corners[0], corners[1]), corners[2])[order]
+
+        # The number of leaves is rounded up to a power of 2, the leaves left over are empty
+        n = len(faces)
+        used_leaves = max((n + leaf_size - 1)//leaf_size, 1)
+        leaves = 1 << (used_leaves - 1).bit_length()
+        bounds = np.zeros((2*leaves, 2, 3))
+        ranges = np.zeros((2*leaves, 2), dtype=np.int64)
+
+        starts = np.arange(used_leaves)*leaf_size
+        if n > 0:
+            bounds[leaves:leaves + used_leaves, 0] = np.minimum.reduceat(triangle_min, starts)
+            bounds[leaves:leaves + used_leaves, 1] = np.maximum.reduceat(triangle_max, starts)
+        bounds[leaves + used_leaves:] = bounds[leaves + used_leaves - 1]
+        ranges[leaves:, 0] = np.minimum(np.arange(leaves)*leaf_size, n)
+        ranges[leaves:, 1] = np.minimum(np.arange(1, leaves + 1)*leaf_size, n)
+
+        # Each level is computed from its children, up to the root
+        size = leaves//2
+        while size > 0:
+            nodes = np.arange(size, 2*size)
+            bounds[nodes, 0] = np.minimum(bounds[2*nodes, 0], bounds[2*nodes + 1, 0])
+            bounds[nodes, 1] = np.maximum(bounds[2*nodes, 1], bounds[2*nodes + 1, 1])
+            ranges[nodes, 0] = ranges[2*nodes, 0]
+            ranges[nodes, 1] = ranges[2*nodes + 1, 1]
+            size //= 2
+
+        return BoundingVolumeHierarchy(bounds, ranges, order.astype(np.int32))
+
+    def frustum_ranges(self, planes):
+        """Returns the ranges of sorted triangles that are not entirely outside of one of the planes.
+
+        The tree is traversed one level at a time. The nodes entirely inside of all the planes are kept
+        without testing their children.
+
+        Args:
+            planes (ndarray): Planes of the view in the space of the mesh, of shape (P, 4)
+
+        Returns:
+            ndarray: First and past the last sorted triangle of the ranges, of shape (R, 2)
+        """
+        ranges = []
+        nodes = np.array([1])
+        while len(nodes) > 0:
+            # A box is outside of a plane if its corner the furthest along the normal of the plane is outside,
+            # and inside if its corner the furthest in the other direction is inside
+            bounds = self.bounds[nodes]
+            positive = planes[:, np.newaxis, :3] > 0
+            furthest = np.where(positive, bounds[np.newaxis, :, 1], bounds[np.newaxis, :, 0])
+            nearest = np.where(positive, bounds[np.newaxis, :, 0], bounds[np.newaxis, :, 1])
+            outside = (np.einsum('pbi,pi->pb', furthest, planes[:, :3]) + planes[:, 3, np.newaxis] < 0).any(axis=0)
+            inside = (np.einsum('pbi,pi->pb', nearest, planes[:, :3]) + planes[:, 3, np.newaxis] >= 0).all(axis=0)
+
+            done = ~outside & (inside | (nodes >= self.leaves))
+            ranges.append(self.ranges[nodes[done]])
+            nodes = nodes[~outside & ~done]
+            nodes = np.stack((2*nodes, 2*nodes + 1), axis=1).reshape(-1)
+        return np.concatenate(ranges)
+
+    def ray_ranges(self, origin, direction):
+        """Returns the ranges of sorted triangles whose boxes are hit by a ray, see frustum_ranges()."""
+        ranges = []
+        nodes = np.array([1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1/np.asarray(direction, dtype=float)
+            while len(nodes) > 0:
+                # Distances along the ray at which it enters and leaves the slabs of each axis of the boxes
+                bounds = self.bounds[nodes]
+                t1 = (bounds[:, 0] - origin)*inverse
+                t2 = (bounds[:, 1] - origin)*inverse
+                enter = np.fmax.reduce(np.fmin(t1, t2), axis=1)
+                leave = np.fmin.reduce(np.fmax(t1, t2), axis=1)
+                hit = leave >= np.maximum(enter, 0)
+
+                ranges.append(self.ranges[nodes[hit & (nodes >= self.leaves)]])
+                nodes = nodes[hit & (nodes < self.leaves)]
+                nodes = np.stack((2*nodes, 2*nodes + 1), axis=1).reshape(-1)
+        return np.concatenate(ranges)
+
+    def triangles(self, ranges):
+        """Returns the indices in the mesh of the triangles of ranges of sorted triangles."""
+        ranges = ranges[ranges[:, 1] > ranges[:, 0]]
+        lengths = ranges[:, 1] - ranges[:, 0]
+        offsets = np.repeat(ranges[:, 0] - (np.cumsum(lengths) - lengths), lengths)
+        return self.order[np.arange(lengths.sum()) + offsets]
+
+
+class BSPTree():
+    def __init__(self, planes, fronts, backs, ranges) -> None:
+        """A binary space partitioning tree of the triangles of a mesh, stored in flat arrays.
+
+        Each node has the plane of one of the triangles. The triangles in this plane belong to the node, the
+        others are in its front or back subtree, depending on their side of the plane. The triangles crossing
+        the plane are split in two. The triangles of a node are consecutive in the mesh, and node 0 is the root.
+
+        Args:
+            planes (ndarray): Plane of each node, of shape (K, 4), a point p is in front if p @ plane > 0
+            fronts (ndarray): Index of the front child of each node, -1 if there is none
+            backs (ndarray): Index of the back child of each node, -1 if there is none
+            ranges (ndarray): First and past the last triangle of each node, of shape (K, 2)
+        """
+        self.planes = planes
+        self.fronts = fronts
+        self.backs = backs
+        self.ranges = ranges
+
+        # The nodes are grouped by depth, so that the tree is traversed with a few array operations per level
+        self.levels = []
+        level = np.array([0] if len(planes) > 0 else [], dtype=np.int64)
+        while len(level) > 0:
+            self.levels.append(level)
+            children = np.concatenate((fronts[level], backs[level]))
+            level = children[children >= 0]
+
+        # Number of triangles of each node and of its subtree. The extra last row is for the missing children,
+        # of index -1, which have no triangles.
+        self.counts = ranges[:, 1] - ranges[:, 0]
+        self.subtree_counts = np.zeros(len(planes) + 1, dtype=np.int64)
+        for level in reversed(self.levels):
+            children_counts = self.subtree_counts[fronts[level]] + self.subtree_counts[backs[level]]
+            self.subtree_counts[level] = self.counts[level] + children_counts
+        self.triangle_nodes = np.repeat(np.arange(len(planes)), self.counts)
+
+    def build(triangles, normals, candidates=32):
+        """Builds the tree of triangles, splitting the triangles that cross the plane of a node.
+
+        The plane of each node is chosen among the planes of a few of its triangles. Each split triangle costs
+        as much as SPLIT_COST triangles of difference between the two sides: choosing only the plane that splits
+        the fewest triangles here gives more splits further down, in a deeper tree.
+
+        Args:
+            triangles (ndarray): Triangles of shape (N, 3, 4)
+            normals (ndarray): Normals of the triangles, of shape (N, 3)
+            candidates (int): Number of planes tried for each node
+
+        Returns:
+            tuple: The tree, and the triangles and their normals in the order of the nodes
+        """
+        planes, fronts, backs, ranges = [], [], [], []
+        sorted_triangles, sorted_normals = [], []
+        count = 0
+
+        # Subsets of triangles waiting for a node, and the node whose child they become
+        stack = [(triangles, normals, -1, None)] if len(triangles) > 0 else []
+        while len(stack) > 0:
+            triangles, normals, parent, children = stack.pop()
+            node = len(planes)
+            if parent >= 0:
+                children[parent] = node
+
+            # Tolerance of the distances to the planes, relative to the size of the triangles
+            epsilon = 1e-9*max(np.abs(triangles[:, :, :3]).max(), 1)
+
+            # The planes of the candidates are all tested at once, distances has a column per candidate
+            chosen = np.linspace(0, len(triangles) - 1, min(candidates, len(triangles))).astype(int)
+            offsets = -np.einsum('ij,ij->i', normals[chosen], triangles[chosen, 0, :3])
+            candidate_planes = np.concatenate((normals[chosen], offsets[:, np.newaxis]), axis=1)
+            distances = triangles @ candidate_planes.T
+            front = (distances > epsilon).any(axis=1)
+            back = (distances < -epsilon).any(axis=1)
+            splits = np.count_nonzero(front & back, axis=0)
+            imbalance = np.abs(np.count_nonzero(front, axis=0) - np.count_nonzero(back, axis=0))
+            best = np.argmin(SPLIT_COST*splits + imbalance)
+            plane, distances, front, back = candidate_planes[best], distances[:, :, best], front[:, best], back[:, best]
+
+            coplanar = ~front & ~back
+            planes.append(plane)
+            fronts.append(-1)
+            backs.append(-1)
+            ranges.append((count, count + np.count_nonzero(coplanar)))
+            count += np.count_nonzero(coplanar)
+            sorted_triangles.append(triangles[coplanar])
+            sorted_normals.append(normals[coplanar])
+
+            # The triangles crossing the plane are split in a part in front and a part behind
+            for side, kept, children in ((-1, back & ~front, backs), (1, front & ~back, fronts)):
+                side_triangles, side_normals = [triangles[kept]], [normals[kept]]
+                for i in np.flatnonzero(front & back):
+                    pieces = _split_triangle(triangles[i], side*distances[i])
+                    side_triangles.append(pieces)
+                    side_normals.append(np.repeat(normals[i][np.newaxis], len(pieces), axis=0))
+                side_triangles = np.concatenate(side_triangles)
+                if len(side_triangles) > 0:
+                    stack.append((side_triangles, np.concatenate(side_normals), node, children))
+
+        bsp = BSPTree(
+            np.array(planes).reshape(-1, 4),
+            np.array(fronts, dtype=np.int64),
+            np.array(backs, dtype=np.int64),
+            np.array(ranges, dtype=np.int64).reshape(-1, 2),
+        )
+        if len(planes) == 0:
+            return bsp, np.empty((0, 3, 4)), np.empty((0, 3))
+        return bsp, np.concatenate(sorted_triangles), np.concatenate(sorted_normals)
+
+    def back_to_front(self, eye):
+        """Returns the indices of the triangles in the order they must be drawn, from the farthest to the closest.
+
+        At each node, the subtree on the other side of the plane than the camera is drawn first, then the
+        triangles of the node, then the subtree on the side of the camera.
+
+        Args:
+            eye (ndarray): Position of the camera (x, y, z, 1), or opposite of its direction (-x, -y, -z, 0) for
+                an orthographic camera, whose point of view is infinitely far away
+        """
+        if len(self.planes) == 0:
+            return np.empty(0, dtype=np.intp)
+
+        # The position in the order of the first triangle of the subtree of each node is known from the level
+        # above: the far subtree comes first, then the triangles of the node, then the near subtree.
+        # The missing children, of index -1, all write to the extra last row.
+        in_front = self.planes @ eye > 0
+        starts = np.zeros(len(self.planes) + 1, dtype=np.int64)
+        node_starts = np.empty(len(self.planes), dtype=np.int64)
+        for level in self.levels:
+            near = np.where(in_front[level], self.fronts[level], self.backs[level])
+            far = np.where(in_front[level], self.backs[level], self.fronts[level])
+            node_starts[level] = starts[level] + self.subtree_counts[far]
+            starts[far] = starts[level]
+            starts[near] = node_starts[level] + self.counts[level]
+
+        # The triangles of a node are consecutive in the mesh and in the order
+        order = np.empty(len(self.triangle_nodes), dtype=np.intp)
+        order[(node_starts - self.ranges[:, 0])[self.triangle_nodes] + np.arange(len(order))] = np.arange(len(order))
+        return order
+
+
+class ChunkedMesh():
+    def __init__(self, path) -> None:
+        """A mesh stored on disk in blocks of triangles, written by save_chunked().
+
+        The triangles are memory-mapped and only the blocks that can be visible are read, each block has its
+        own bounding box. The memory used doesn't depend on the size of the mesh, only on what is in view.
+
+        Args:
+            path (str): Folder of the mesh
+        """
+        with open(os.path.join(path, "mesh.json")) as f:
+            self.block_size = json.load(f)["block_size"]
+        self.triangles = np.load(os.path.join(path, "triangles.npy"), mmap_mode='r')
+        self.normals = np.load(os.path.join(path, "normals.npy"), mmap_mode='r')
+
+        # Bounding boxes of the blocks, of shape (B, 2, 3): the minimum then the maximum corner
+        self.bounds = np.load(os.path.join(path, "bounds.npy"))
+
+        # The triangles of a block are stored one after the other, their vertices don't need indices
+        self._faces = np.arange(3*self.block_size, dtype=np.int32).reshape(-1, 3)
+
+        # Bounding box of the whole mesh, and the sphere containing it
+        if len(self.bounds) > 0:
+            self.aabb_min = self.bounds[:, 0].min(axis=0)
+            self.aabb_max = self.bounds[:, 1].max(axis=0)
+        else:
+            self.aabb_min = np.zeros(3)
+            self.aabb_max = np.zeros(3)
+        self.center = (self.aabb_min + self.aabb_max)/2
+        self.radius = np.linalg.norm(self.aabb_max - self.center)
+
+        # Number of blocks read during the last call to visible_parts()
+        self.visible_blocks = 0
+
+        # The blocks are only culled, they have no levels of detail nor BSP tree
+        self.lods = []
+        self.lod_cell_sizes = np.zeros(0)
+        self.bsp = None
+
+    def visible_parts(self, planes, eye=None):
+        """Yields the vertices, faces and normals of the blocks that are not entirely outside of one of the planes,
+        and the range of their triangles in the mesh.
+
+        Args:
+            planes (ndarray): Planes of the view in the space of the mesh, of shape (P, 4)
+            eye (ndarray): Position of the camera, not used
+        """
+        # A box is outside of a plane if its corner the furthest along the normal of the plane is outside
+        corners = np.where(planes[:, np.newaxis, :3] > 0, self.bounds[np.newaxis, :, 1], self.bounds[np.newaxis, :, 0])
+        distances = np.einsum('pbi,pi->pb', corners, planes[:, :3]) + planes[:, 3, np.newaxis]
+        visible = np.flatnonzero((distances >= 0).all(axis=0))
+        self.visible_blocks = len(visible)
+
+        for block in visible:
+            start = block*self.block_size
+            triangles = np.array(self.triangles[start:start + self.block_size])
+            normals = np.array(self.normals[start:start + self.block_size])
+            yield triangles.reshape(-1, 4), self._faces[:len(triangles)], normals, slice(start, start + len(triangles))
+
+
+def save_chunked(path, triangles, block_size=BLOCK_SIZE):
+    """Writes triangles in blocks to be loaded as a ChunkedMesh.
+
+    The triangles are sorted along a Z-order curve of their centers, so that the triangles of a block are close
+    to each other and the bounding boxes of the blocks are small. Only the centers are loaded in memory at once,
+    the triangles can be a memory-mapped array.
+
+    Args:
+        path (str): Folder in which the mesh is written
+        triangles (ndarray): Triangles of shape (N, 3, 3) or (N, 3, 4)
+        block_size (int): Number of triangles in each block
+    """
+    n = len(triangles)
+    centroids = np.empty((n, 3))
+    for start in range(0, n, block_size):
+        centroids[start:start + block_size] = np.asarray(triangles[start:start + block_size])[:, :, :3].mean(axis=1)
+    order = np.argsort(_morton_codes(centroids), kind='stable')
+
+    os.makedirs(path, exist_ok=True)
+    sorted_triangles = np.lib.format.open_memmap(os.path.join(path, "triangles.npy"), mode='w+', dtype=float, shape=(n, 3, 4))
+    normals = np.lib.format.open_memmap(os.path.join(path, "normals.npy"), mode='w+', dtype=float, shape=(n, 3))
+    bounds = np.empty(((n + block_size - 1)//block_size, 2, 3))
+
+    for block, start in enumerate(range(0, n, block_size)):
+        end = min(start + block_size, n)
+        block_triangles = np.array(triangles[order[start:end]], dtype=float)
+        sorted_triangles[start:end, :, :block_triangles.shape[2]] = block_triangles
+        sorted_triangles[start:end, :, 3] = 1 if block_triangles.shape[2] == 3 else block_triangles[:, :, 3]
+        normals[start:end] = _face_normals(block_triangles)
+        bounds[block, 0] = block_triangles[:, :, :3].min(axis=(0, 1))
+        bounds[block, 1] = block_triangles[:, :, :3].max(axis=(0, 1))
+
+    sorted_triangles.flush()
+    normals.flush()
+    np.save(os.path.join(path, "bounds.npy"), bounds)
+    with open(os.path.join(path, "mesh.json"), "w") as f:
+        json.dump({"block_size": block_size}, f)
+
+
+def _split_triangle(triangle, distances):
+    """Returns the triangles covering the part of a triangle on the positive side of a plane.
+
+    Args:
+        triangle (ndarray): Vertices of the triangle, of shape (3, 4)
+        distances (ndarray): Distances of the vertices to the plane, of shape (3,)
+    """
+    # The polygon left is made of the vertices inside and of the points where the edges cross the plane
+    polygon = []
+    for i in range(3):
+        a, b = triangle[i], triangle[(i + 1) % 3]
+        da, db = distances[i], distances[(i + 1) % 3]
+        if da >= 0:
+            polygon.append(a)
+        if (da > 0 and db < 0) or (da < 0 and db > 0):
+            polygon.append(a + (b - a)*(da/(da - db)))
+
+    # Fan triangulation of the polygon, which keeps the winding order
+    return np.array([(polygon[0], polygon[i], polygon[i + 1]) for i in range(1, len(polygon) - 1)]).reshape(-1, 3, 4)
+
+
+def _morton_codes(points):
+    """Returns the position of the points along a Z-order curve going through their bounding box."""
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # The coordinates are quantized to 10 bits, whose bits are interleaved. All the axes share the same scale,
+    # so that the cells stay cubes and a flat axis does not take as many bits as the wide ones.
+    low = points.min(axis=0)
+    size = max((points.max(axis=0) - low).max(), 1e-12)
+    quantized = ((points - low)/size*1023).astype(np.int64)
+    codes = np.zeros(len(points), dtype=np.int64)
+    for bit in range(10):
+        for axis in range(3):
+            codes |= ((quantized[:, axis] >> bit) & 1) << (3*bit + axis)
+    return codes
+
+
+def _face_normals(triangles):
+    """Returns the normals of unit length of triangles of shape (N, 3, 3) or (N, 3, 4)."""
+    line1 = triangles[:, 1, :3] - triangles[:, 0, :3]
+    line2 = triangles[:, 2, :3] - triangles[:, 0, :3]
+    normals = np.cross(line1, line2)
+    normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+    return normals
+
+
+def _read_only(array, dtype):
+    """Returns the array with the given type as a read-only array, copied unless it is already read-only."""
+    if not (isinstance(array, np.ndarray) and array.dtype == dtype and not array.flags.writeable):
+        array = np.array(array, dtype=dtype)
+        array.flags.writeable = False
+    return array
+
+
+def _load_cache(path):
+    """Returns the cached mesh of an OBJ file with its hierarchy and its levels of detail, or None if there is
+    none or if the file changed since."""
+    directory = path + CACHE_SUFFIX
+    try:
+        with open(os.path.join(directory, "source.json")) as f:
+            source = json.load(f)
+        stat = os.stat(path)
+
+        if source["size"] != stat.st_size or source["bvh_leaf_size"] != BVH_LEAF_SIZE:
+            return None
+        if source["mtime_ns"] != stat.st_mtime_ns:
+            # The file was modified or only touched (e.g. copied), the content tells which one
+            with open(path, 'rb') as f:
+                if hashlib.sha256(f.read()).hexdigest() != source["sha256"]:
+                    return None
+            source["mtime_ns"] = stat.st_mtime_ns
+            with open(os.path.join(directory, "source.json"), "w") as f:
+                json.dump(source, f)
+
+        mesh = _load_arrays(directory, "")
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # The levels of detail are optional, they are only saved once they are needed
+    try:
+        with open(os.path.join(directory, "lods.json")) as f:
+            cell_sizes = json.load(f)["cell_sizes"]
+        lods = [_load_arrays(directory, "lod%d_" % level) for level in range(len(cell_sizes))]
+        mesh.set_lods(lods, cell_sizes)
+    except (OSError, ValueError, KeyError):
+        pass
+    return mesh
+
+
+def _load_arrays(directory, prefix):
+    """Returns a mesh whose arrays saved with a prefix in the folder of a cache are memory-mapped."""
+    arrays = {}
+    for name in ("vertices", "faces", "normals"):
+        arrays[name] = np.load(os.path.join(directory, prefix + name + ".npy"), mmap_mode='r')
+    mesh = Mesh(**arrays)
+
+    if len(mesh.faces) > BVH_LEAF_SIZE:
+        arrays = {}
+        for name in ("bounds", "ranges", "order"):
+            arrays[name] = np.load(os.path.join(directory, prefix + "bvh_" + name + ".npy"), mmap_mode='r')
+        mesh._bvh = BoundingVolumeHierarchy(**arrays)
+    return mesh
+
+
+def _save_arrays(directory, prefix, mesh):
+    """Saves the arrays of a mesh and of its hierarchy with a prefix in the folder of a cache."""
+    for name in ("vertices", "faces", "normals"):
+        _save_array(os.path.join(directory, prefix + name + ".npy"), getattr(mesh, name))
+    if mesh.bvh is not None:
+        for name in ("bounds", "ranges", "order"):
+            _save_array(os.path.join(directory, prefix + "bvh_" + name + ".npy"), getattr(mesh.bvh, name))
+
+
+def _save_array(path, array):
+    """Saves an array in a .npy file of a cache.
+
+    The array is written to a new file which then replaces the previous one: the previous file may still be
+    memory-mapped by a mesh loaded earlier, by this process or another one, and truncating it would crash them.
+    """
+    temporary = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(temporary, "wb") as f:
+            np.save(f, array)
+        os.replace(temporary, path)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _save_cache(path, mesh, source):
+    """Saves the arrays of the mesh of an OBJ file, along with the size, modification time and hash of the file."""
+    directory = path + CACHE_SUFFIX
+    try:
+        os.makedirs(directory, exist_ok=True)
+
+        # The description of the source is written last, an interrupted save leaves an invalid cache.
+        # The levels of detail of the previous version of the file are invalidated too.
+        for name in ("source.json", "lods.json"):
+            if os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+        source_path = os.path.join(directory, "source.json")
+        _save_arrays(directory, "", mesh)
+        with open(source_path, "w") as f:
+            json.dump(source, f)
+    except OSError:
+        # The cache is only an optimization, the mesh can be loaded without it (e.g. from a read-only folder)
+        pass
+
+
+def _save_lods(path, mesh):
+    """Saves the levels of detail of the mesh of an OBJ file in its cache."""
+    directory = path + CACHE_SUFFIX
+    try:
+        lods_path = os.path.join(directory, "lods.json")
+        if os.path.exists(lods_path):
+            os.remove(lods_path)
+        for level, lod in enumerate(mesh.lods):
+            _save_arrays(directory, "lod%d_" % level, lod)
+        with open(lods_path, "w") as f:
+            json.dump({"cell_sizes": mesh.lod_cell_sizes.tolist()}, f)
+    except OSError:
+        pass
+
+
+def _parse_records(buffer, line_starts, line_lengths, lines, dtype):
+    """Parses the numbers following the one letter keyword of the selected lines of an OBJ file.
+
+    For tokens like 1/2/3, only the number before the first slash is kept.
+
+    Returns:
+        tuple: The numbers of all the lines, one after the other, and the number of numbers on each line
+    """
+    kept = np.repeat(lines, line_lengths)
+    kept[line_starts[lines]] = False
+    text = buffer[kept]
+
+    # A token starts at each character that is not a space and follows a space (the keyword was a space)
+    space = text <= ord(' ')
+    token_start = ~space & np.concatenate(([True], space[:-1]))
+    count = np.count_nonzero(lines)
+    text_lines = np.repeat(np.arange(count, dtype=np.int32), line_lengths[lines] - 1)
+    counts = np.bincount(text_lines[token_start], minlength=count)
+
+    # The characters after a slash are dropped if the slash is in the same token
+    slashes = text == ord('/')
+    if slashes.any():
+        index = np.arange(len(text), dtype=np.int32)
+        last_slash = np.maximum.accumulate(np.where(slashes, index, -1))
+        last_token_start = np.maximum.accumulate(np.where(token_start, index, -1))
+        text = text[space | (last_slash < last_token_start)]
+
+    numbers = np.fromstring(text.tobytes(), dtype=dtype, sep=' ')
+    return numbers, counts
@@ -0,0 +1,133 @@
+import numpy as np
+
+
+class Framebuffer():
+    # Maximum number of pixels tested at once, bounds the size of the temporary arrays
+    PIXELS_PER_BATCH = 1 << 18
+
+    def __init__(self, width, height, extent, background=(1, 1, 1)):
+        """A color buffer and a depth buffer in which triangles are rasterized.
+
+        Args:
+            width (int): Width of the buffer in pixels
+            height (int): Height of the buffer in pixels
+            extent (tuple): Area of the screen covered by the buffer (left, right, bottom, top)
+            background (tuple): RGB color used to clear the buffer
+        """
+        self.WIDTH = width
+        self.HEIGHT = height
+        self.EXTENT = extent
+        self.background = np.array(background, dtype=np.float32)
+
+        # The first row of the buffers is the bottom of the screen
+        self.color = np.empty((height, width, 3), dtype=np.float32)
+        self.depth = np.empty((height, width), dtype=float)
+        self.clear()
+
+    def clear(self):
+        self.color[:] = self.background
+        self.depth[:] = np.inf
+        # Depth of the next triangle drawn without depth, each one is a bit closer than the previous one
+        self._painter_depth = 0
+
+    def triangles(self, verts, colors, depths=None):
+        """Rasterizes filled triangles, keeping for each pixel the closest triangle.
+
+        Args:
+            verts (ndarray): Screen coordinates of the triangles, of shape (N, 3, 2)
+            colors (ndarray): RGB or RGBA colors of the triangles, of shape (N, 3) or (N, 4). Alpha is ignored.
+            depths (ndarray): Depth of each vertex, of shape (N, 3). The smallest depth is the closest.
+                Without depths, the triangles are drawn in the order they are given.
+        """
+        colors = np.asarray(colors)
+
+        # Triangles that were projected to infinity (e.g. at the camera position) can't be drawn
+        finite = np.isfinite(verts).all(axis=(1, 2))
+        if not finite.all():
+            verts = verts[finite]
+            colors = colors[finite]
+            depths = None if depths is None else depths[finite]
+
+        n = len(verts)
+        if n == 0:
+            return
+
+        if depths is None:
+            depths = np.repeat(self._painter_depth - np.arange(n, dtype=float)[:, np.newaxis], 3, axis=1)
+            self._painter_depth -= n
+
+        # Conversion to pixel coordinates, the center of the pixel (i, j) is at (i + 0.5, j + 0.5)
+        left, right, bottom, top = self.EXTENT
+        x = (verts[:, :, 0] - left)*(self.WIDTH/(right - left))
+        y = (verts[:, :, 1] - bottom)*(self.HEIGHT/(top - bottom))
+
+        # Bounding box of the pixel centers covered by each triangle, clamped to the buffer
+        x_min = np.maximum(np.ceil(x.min(axis=1) - 0.5), 0).astype(int)
+        x_max = np.minimum(np.floor(x.max(axis=1) - 0.5), self.WIDTH - 1).astype(int)
+        y_min = np.maximum(np.ceil(y.min(axis=1) - 0.5), 0).astype(int)
+        y_max = np.minimum(np.floor(y.max(axis=1) - 0.5), self.HEIGHT - 1).astype(int)
+
+        # Twice the signed area of the triangles, its sign gives the winding order
+        area = (x[:, 1] - x[:, 0])*(y[:, 2] - y[:, 0]) - (x[:, 2] - x[:, 0])*(y[:, 1] - y[:, 0])
+
+        # Triangles that are flat, off-screen or between pixel centers are skipped
+        drawn = np.flatnonzero((area != 0) & (x_min <= x_max) & (y_min <= y_max))
+
+        # Triangles are grouped by the size of their bounding box (rounded up to a power of two),
+        # so that each group can be tested against a square grid of pixels in a single pass
+        size = np.maximum(x_max[drawn] - x_min[drawn], y_max[drawn] - y_min[drawn]) + 1
+        levels = np.ceil(np.log2(size)).astype(int)
+
+        for level in np.unique(levels):
+            group = drawn[levels == level]
+            side = 1 << level
+            batch = max(1, self.PIXELS_PER_BATCH // (side*side))
+            for start in range(0, len(group), batch):
+                self._rasterize(group[start:start + batch], side, x, y, area, depths, colors, x_min, x_max, y_min, y_max)
+
+    def _rasterize(self, t, side, x, y, area, depths, colors, x_min, x_max, y_min, y_max):
+        """Rasterizes the triangles of index t whose bounding boxes fit in a square of side pixels."""
+        offset_y, offset_x = np.divmod(np.arange(side*side), side)
+        px = x_min[t, np.newaxis] + offset_x
+        py = y_min[t, np.newaxis] + offset_y
+        inside = (px <= x_max[t, np.newaxis]) & (py <= y_max[t, np.newaxis])
+
+        # Edge functions, normalized by the area they are the barycentric coordinates of the pixel centers
+        cx = px + 0.5
+        cy = py + 0.5
+        x0, x1, x2 = (x[t, i, np.newaxis] for i in range(3))
+        y0, y1, y2 = (y[t, i, np.newaxis] for i in range(3))
+        inverse_area = 1/area[t, np.newaxis]
+        b0 = ((x2 - x1)*(cy - y1) - (y2 - y1)*(cx - x1))*inverse_area
+        b1 = ((x0 - x2)*(cy - y2) - (y0 - y2)*(cx - x2))*inverse_area
+        b2 = ((x1 - x0)*(cy - y0) - (y1 - y0)*(cx - x0))*inverse_area
+        inside &= (b0 >= 0) & (b1 >= 0) & (b2 >= 0)
+
+        rows, columns = np.nonzero(inside)
+        if len(rows) == 0:
+            return
+        pixels = py[rows, columns]*self.WIDTH + px[rows, columns]
+        triangles = t[rows]
+        z = (
+            b0[rows, columns]*depths[triangles, 0]
+            + b1[rows, columns]*depths[triangles, 1]
+            + b2[rows, columns]*depths[triangles, 2]
+        )
+
+        # For each pixel, only the closest fragment is kept
+        order = np.lexsort((z, pixels))
+        pixels = pixels[order]
+        z = z[order]
+        triangles = triangles[order]
+        first = np.ones(len(pixels), dtype=bool)
+        first[1:] = pixels[1:] != pixels[:-1]
+        pixels = pixels[first]
+        z = z[first]
+        triangles = triangles[first]
+
+        # Depth test against what is already in the buffer
+        depth = self.depth.reshape(-1)
+        closer = z <= depth[pixels]
+        pixels = pixels[closer]
+        depth[pixels] = z[closer]
+        self.color.reshape(-1, 3)[pixels] = colors[triangles[closer], :3]
@@ -3,23 +3,441 @@ import numpy as np
 import matplotlib.colors as mc
 import colorsys
 from matrix import Matrix4x4
+from mesh import Mesh, ChunkedMesh
+
+
+# Number of shades precomputed for each color
+SHADE_LEVELS = 256
+
+# Fraction of the triangles out of order above which the order of the previous frame is not reused
+RESORT_RATIO = 0.25
+
+
+def shade_table(color, levels=SHADE_LEVELS):
+    """Returns the shades of a color for all the light levels, of shape (levels, 3).
+
+    The level i is the shade of a face whose normal is aligned by -1 + 2i/(levels - 1) with the light.
+    """
+    hue, lightness, saturation = colorsys.rgb_to_hls(*mc.to_rgb(color))
+    alignments = np.linspace(-1, 1, levels)
+    lightnesses = np.clip(lightness*(alignments + 1)/2.5, 0, 1)
+    return np.array([colorsys.hls_to_rgb(hue, l, saturation) for l in lightnesses])
+
+
+def _rotate_vertices(triangles, distances, first):
+    """Rotates the vertices of each triangle so that the vertex of index first comes first, keeping the winding order."""
+    rows = np.arange(len(triangles))[:, np.newaxis]
+    columns = (first[:, np.newaxis] + np.arange(3)) % 3
+    triangles = triangles[rows, columns]
+    distances = distances[rows, columns]
+    return triangles[:, 0], triangles[:, 1], triangles[:, 2], distances[:, 0], distances[:, 1], distances[:, 2]
+
+
+def _line_plane_intersection(start, end, start_distance, end_distance):
+    """Returns the points where the segments cross the plane, given the signed distances of their ends to the plane."""
+    t = start_distance/(start_distance - end_distance)
+    return start + t[:, np.newaxis]*(end - start)
+
+
+def clip_against_plane(triangles, plane, keep_order=False, scratch=None, name="clipped"):
+    """Clips triangles against a plane, only keeping their part on the inner side of the plane.
+
+    A triangle with one vertex inside becomes a smaller triangle, a triangle with two vertices inside
+    becomes a quad that is split in two triangles. The winding order of the triangles is kept.
+
+    Args:
+        triangles (ndarray): Triangles in homogeneous coordinates, of shape (N, 3, 4)
+        plane (ndarray): Plane of shape (4,), a point p is inside if p @ plane >= 0
+        keep_order (bool): The triangles made by clipping a triangle are put in its place instead of at the end
+        scratch (ScratchBuffers): Buffers the arrays are written in, the arrays returned are views on them
+        name (str): Name of the buffers of the arrays returned, which must not be the buffer of the triangles
+
+    Returns:
+        tuple: The clipped triangles, and for each of them the index of the triangle it comes from. The
+            triangles are returned as they are if they are all inside.
+    """
+    scratch = ScratchBuffers(triangles.dtype) if scratch is None else scratch
+    count = len(triangles)
+    distances = scratch.get("clip_distances", (count, 3), triangles.dtype)
+    np.matmul(triangles, plane.astype(triangles.dtype), out=distances)
+    inside = np.greater_equal(distances, 0, out=scratch.get("clip_inside", (count, 3), bool))
+    inside_count = np.add.reduce(inside, axis=1, dtype=np.intp, out=scratch.get("clip_inside_count", (count,), np.intp))
+
+    whole = np.equal(inside_count, 3, out=scratch.get("clip_whole", (count,), bool))
+    whole_count = np.count_nonzero(whole)
+    if whole_count == count:
+        return triangles, scratch.indices(count)
+
+    # Only the triangles crossing the plane are clipped, they are few and their arrays are small.
+    crossing = scratch.get("clip_crossing", (count,), bool)
+
+    # One vertex inside: the triangle is made smaller
+    one = np.flatnonzero(np.equal(inside_count, 1, out=crossing))
+    a, b, c, da, db, dc = _rotate_vertices(triangles[one], distances[one], np.argmax(inside[one], axis=1))
+    one_triangles = np.stack((a, _line_plane_intersection(a, b, da, db), _line_plane_intersection(a, c, da, dc)), axis=1)
+
+    # Two vertices inside: the outside vertex comes first, the quad left is split in two triangles
+    two = np.flatnonzero(np.equal(inside_count, 2, out=crossing))
+    a, b, c, da, db, dc = _rotate_vertices(triangles[two], distances[two], np.argmin(inside[two], axis=1))
+    ab = _line_plane_intersection(b, a, db, da)
+    ca = _line_plane_intersection(c, a, dc, da)
+
+    # Index of the triangle each clipped triangle comes from, and the positions of the triangles made by clipping
+    total = whole_count + len(one) + 2*len(two)
+    source = scratch.get(name + "_source", (total,), np.intp)
+    if keep_order:
+        # Each triangle is followed by the triangles made from it, the first one made from the triangle i is at
+        # ends[i - 1]. The cumulative sum of the number of ends at or before each position gives its triangle.
+        made = scratch.get("clip_made", (count,), np.intp)
+        np.take(np.array([0, 1, 2, 1], dtype=np.intp), inside_count, out=made)
+        ends = np.cumsum(made, out=made)
+        marks = scratch.get("clip_marks", (total + 1,), np.intp)
+        marks[:] = 0
+        np.add.at(marks, ends, 1)
+        np.cumsum(marks[:total], out=source)
+        one_positions = ends[one] - 1
+        first_positions = ends[two] - 2
+        second_positions = first_positions + 1
+    else:
+        # The triangles inside are kept in their order, the triangles made by clipping are at the end
+        np.compress(whole, scratch.indices(count), out=source[:whole_count])
+        source[whole_count:] = np.concatenate((one, two, two))
+        one_positions = np.arange(whole_count, whole_count + len(one))
+        first_positions = np.arange(whole_count + len(one), total - len(two))
+        second_positions = first_positions + len(two)
+
+    clipped = scratch.get(name, (total, 3, 4), triangles.dtype)
+    np.take(triangles, source, axis=0, out=clipped, mode='clip')
+    clipped[one_positions] = one_triangles
+    clipped[first_positions] = np.stack((ab, b, c), axis=1)
+    clipped[second_positions] = np.stack((ab, c, ca), axis=1)
+    return clipped, source
+
+
+def _normal_matrices(models):
+    """Returns the matrices transforming the normals of a mesh for model matrices of shape (..., 4, 4).
+
+    The cofactor matrix of the linear part keeps the normals perpendicular to the faces when the scale is not
+    uniform, its sign follows the determinant for mirrored models. The normals are not of unit length after.
+    """
+    linear = models[..., :3, :3]
+    cofactors = np.stack((
+        np.cross(linear[..., 1, :], linear[..., 2, :]),
+        np.cross(linear[..., 2, :], linear[..., 0, :]),
+        np.cross(linear[..., 0, :], linear[..., 1, :]),
+    ), axis=-2)
+    return cofactors*np.sign(np.linalg.det(linear))[..., np.newaxis, np.newaxis]
+
+
+def _stretches(models):
+    """Returns by how much model matrices of shape (M, 4, 4) can stretch a length at most.
+
+    It is the largest singular value of their linear part. The longest row is only as large for the matrices
+    that scale before they rotate, not for the ones that rotate before they scale or that shear.
+    """
+    return np.linalg.norm(models[:, :3, :3], ord=2, axis=(1, 2))
 
 
 class Entity():
-    def __init__(self, mesh=[], position=[0, 0, 0], color="#ffa75e"):
-        # Adding 4th dimension to all vectors
-        for triangle in mesh:
-            for point in triangle:
-                if len(point) == 3:
-                    point.append(1)
-
-        self.mesh = np.array(mesh, dtype=float)
-        self.position = np.array(position)
+    def __init__(self, mesh=[], position=[0, 0, 0], color="#ffa75e", rotation=[0, 0, 0], scale=[1, 1, 1]):
+        """A mesh placed in the world.
+
+        The model matrix is cached. Like for the camera, the position, rotation and scale are read-only arrays:
+        they must be replaced, not modified in place, for the change to be noticed.
+
+        Args:
+            mesh (Mesh): The mesh of the entity, or its triangles
+            position (list): Position of the origin of the mesh in the world
+            color (str): Color of the entity
+            rotation (list): Angles in radian of the rotations around the X, Y and Z axes, applied in this order
+            scale (list): Scale along the X, Y and Z axes of the mesh, applied before the rotations
+        """
+        # The normals and bounds of the mesh are computed once by the mesh, which can be shared between entities
+        self.mesh = mesh if isinstance(mesh, (Mesh, ChunkedMesh)) else Mesh(mesh)
+        self._model_matrix = None
+        self.position = position
+        self.rotation = rotation
+        self.scale = scale
         self.color = color
 
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = np.array(position, dtype=float)
+        self._position.flags.writeable = False
+        self._model_matrix = None
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self._rotation = np.array(rotation, dtype=float)
+        self._rotation.flags.writeable = False
+        self._model_matrix = None
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, scale):
+        self._scale = np.broadcast_to(np.array(scale, dtype=float), 3).copy()
+        self._scale.flags.writeable = False
+        self._model_matrix = None
+
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, color):
+        self._color = color
+        self._shades = None
+
+    @property
+    def shades(self):
+        """The shades of the color of the entity, computed once per color."""
+        if self._shades is None:
+            self._shades = shade_table(self._color)
+        return self._shades
+
     def translation_matrix(self):
         return Matrix4x4.translation(self.position[0], self.position[1], self.position[2])
 
+    def model_matrix(self):
+        """Transformation from the space of the mesh to the world: scale, then rotation, then translation."""
+        if self._model_matrix is None:
+            self._model_matrix = (
+                Matrix4x4.scaling(self.scale[0], self.scale[1], self.scale[2])
+                @ Matrix4x4.rotationX(self.rotation[0])
+                @ Matrix4x4.rotationY(self.rotation[1])
+                @ Matrix4x4.rotationZ(self.rotation[2])
+                @ self.translation_matrix()
+            )
+            self._model_matrix.flags.writeable = False
+        return self._model_matrix
+
+    def bounding_sphere(self):
+        """Returns the center and the radius of a sphere containing the entity, in world space."""
+        model = self.model_matrix()
+        center = np.append(self.mesh.center, 1) @ model
+        return center[:3], self.mesh.radius*np.linalg.norm(model[:3, :3], axis=1).max()
+
+
+class InstancedEntity():
+    def __init__(self, mesh=[], model_matrices=[], colors=[]):
+        """Copies of a mesh, each with its own model matrix and color, drawn together in a single batch.
+
+        The model matrices can be modified in place. The colors must be replaced for their shades to be updated.
+
+        Args:
+            mesh (Mesh): The mesh shared by all the instances
+            model_matrices (list): Transformations from the space of the mesh to the world, of shape (M, 4, 4)
+            colors (list): RGB colors of the instances, of shape (M, 3)
+        """
+        self.mesh = mesh if isinstance(mesh, Mesh) else Mesh(mesh)
+        self.model_matrices = np.array(model_matrices, dtype=float).reshape(-1, 4, 4)
+        self._shade_tables = {}
+        self.colors = colors
+
+    def __len__(self):
+        return len(self.model_matrices)
+
+    @property
+    def colors(self):
+        return self._colors
+
+    @colors.setter
+    def colors(self, colors):
+        colors = np.array(colors, dtype=float).reshape(-1, 3)
+        colors.flags.writeable = False
+        self._colors = colors
+
+        # The shades are computed once for each different color, shade_ids gives the shades of each instance.
+        # The shades of the colors already seen are kept, adding or removing instances does not compute them again.
+        unique_colors, inverse = np.unique(colors, axis=0, return_inverse=True)
+        tables = []
+        for color in map(tuple, unique_colors):
+            if color not in self._shade_tables:
+                self._shade_tables[color] = shade_table(color)
+            tables.append(self._shade_tables[color])
+        self.shades = np.array(tables).reshape(-1, SHADE_LEVELS, 3)
+        self.shade_ids = inverse.reshape(-1)
+
+    def add_instance(self, model_matrix, color):
+        self.model_matrices = np.concatenate((self.model_matrices, np.reshape(model_matrix, (1, 4, 4))))
+        self.colors = np.concatenate((self._colors, np.reshape(color, (1, 3))))
+
+    def remove_instances(self, indices):
+        self.model_matrices = np.delete(self.model_matrices, indices, axis=0)
+        self.colors = np.delete(self._colors, indices, axis=0)
+
+
+class EntityRegistry():
+    # Arrays of the registry and the shape of their rows
+    ARRAYS = {
+        "handles": ((), np.int64),
+        "positions": ((3,), float),
+        "rotations": ((3,), float),
+        "scales": ((3,), float),
+        "colors": ((3,), float),
+        "shade_ids": ((), np.intp),
+        "mesh_ids": ((), np.intp),
+        "visible": ((), bool),
+    }
+
+    def __init__(self):
+        """Entities stored as a structure of arrays, so that thousands of them are handled without a loop per entity.
+
+        Each entity is a row of the arrays. create() returns a handle that stays valid until the entity is removed.
+        Removing an entity moves the last row in its place, so slot() must be used to find the current row of a
+        handle. The arrays can be modified in place, except colors which must be changed with set_color().
+        They are views that are only valid until the next entity is created or removed.
+        """
+        self.meshes = []
+        self._mesh_ids = {}
+        self._shades = np.empty((0, SHADE_LEVELS, 3))
+        self._shade_ids = {}
+
+        self._slots = {}
+        self._next_handle = 0
+        self._size = 0
+        self._arrays = {name: np.empty((0,) + shape, dtype=dtype) for name, (shape, dtype) in self.ARRAYS.items()}
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def shades(self):
+        """The shades of each different color, of shape (C, SHADE_LEVELS, 3), indexed by shade_ids."""
+        return self._shades[:len(self._shade_ids)]
+
+    def __getattr__(self, name):
+        # The arrays are seen through views on their rows in use
+        if name in EntityRegistry.ARRAYS:
+            return self._arrays[name][:self._size]
+        raise AttributeError(name)
+
+    def create(self, mesh, position=[0, 0, 0], rotation=[0, 0, 0], scale=[1, 1, 1], color="#ffa75e"):
+        """Adds an entity and returns its handle. The arguments are the same as for Entity."""
+        if self._size == len(self._arrays["handles"]):
+            # The arrays double in size when they are full
+            capacity = max(16, 2*self._size)
+            for name, array in self._arrays.items():
+                grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+                grown[:self._size] = array[:self._size]
+                self._arrays[name] = grown
+
+        handle = self._next_handle
+        self._next_handle += 1
+        slot = self._size
+        self._size += 1
+        self._slots[handle] = slot
+
+        self._arrays["handles"][slot] = handle
+        self._arrays["positions"][slot] = position
+        self._arrays["rotations"][slot] = rotation
+        self._arrays["scales"][slot] = scale
+        self._arrays["mesh_ids"][slot] = self._mesh_id(mesh)
+        self._arrays["visible"][slot] = True
+        self.set_color(handle, color)
+        return handle
+
+    def remove(self, handle):
+        """Removes an entity, the last row is moved in its place."""
+        slot = self._slots.pop(handle)
+        last = self._size - 1
+        if slot != last:
+            for array in self._arrays.values():
+                array[slot] = array[last]
+            self._slots[self._arrays["handles"][slot]] = slot
+        self._size -= 1
+
+    def slot(self, handle):
+        """Returns the row of an entity in the arrays."""
+        return self._slots[handle]
+
+    def set_color(self, handle, color):
+        slot = self._slots[handle]
+        color = mc.to_rgb(color)
+        self._arrays["colors"][slot] = color
+
+        # The shades are computed once for each different color
+        if color not in self._shade_ids:
+            count = len(self._shade_ids)
+            if count == len(self._shades):
+                # Like the arrays of the entities, the table doubles in size when it is full
+                grown = np.empty((max(16, 2*count), SHADE_LEVELS, 3))
+                grown[:count] = self._shades
+                self._shades = grown
+            self._shades[count] = shade_table(color)
+            self._shade_ids[color] = count
+        self._arrays["shade_ids"][slot] = self._shade_ids[color]
+
+    def _mesh_id(self, mesh):
+        mesh = mesh if isinstance(mesh, Mesh) else Mesh(mesh)
+        if id(mesh) not in self._mesh_ids:
+            self._mesh_ids[id(mesh)] = len(self.meshes)
+            self.meshes.append(mesh)
+        return self._mesh_ids[id(mesh)]
+
+    def model_matrices(self):
+        """Returns the model matrices of all the entities, of shape (M, 4, 4). Same transformations as Entity."""
+        cos, sin = np.cos(self.rotations.T), np.sin(self.rotations.T)
+        ones, zeros = np.ones(len(self)), np.zeros(len(self))
+        rotation_x = np.stack((ones, zeros, zeros, zeros, cos[0], sin[0], zeros, -sin[0], cos[0]), axis=1)
+        rotation_y = np.stack((cos[1], zeros, sin[1], zeros, ones, zeros, -sin[1], zeros, cos[1]), axis=1)
+        rotation_z = np.stack((cos[2], sin[2], zeros, -sin[2], cos[2], zeros, zeros, zeros, ones), axis=1)
+        rotations = (rotation_x.reshape(-1, 3, 3) @ rotation_y.reshape(-1, 3, 3) @ rotation_z.reshape(-1, 3, 3))
+
+        models = np.zeros((len(self), 4, 4))
+        models[:, :3, :3] = self.scales[:, :, np.newaxis]*rotations
+        models[:, 3, :3] = self.positions
+        models[:, 3, 3] = 1
+        return models
+
+
+class ScratchBuffers():
+    def __init__(self, dtype=np.float64):
+        """Work arrays kept from frame to frame, so that drawing a frame doesn't allocate large arrays.
+
+        Each buffer grows to the largest size requested and is never shrunk, its content is kept when it grows.
+        The arrays returned are views on the buffers, they are only valid until the buffer is requested again.
+
+        Args:
+            dtype (type): Type of the buffers requested without type
+        """
+        self.dtype = np.dtype(dtype)
+        self._buffers = {}
+        self._indices = None
+
+    def indices(self, count):
+        """Returns the integers from 0 to count - 1, kept from call to call."""
+        if self._indices is None or len(self._indices) < count:
+            # Like the buffers, the integers grow by half at least
+            size = count if self._indices is None else max(count, len(self._indices)*3//2)
+            self._indices = np.arange(size, dtype=np.intp)
+        return self._indices[:count]
+
+    def get(self, name, shape, dtype=None):
+        """Returns a view of the given shape on the buffer of the given name."""
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(size, dtype=dtype)
+        elif len(buffer) < size:
+            # The buffer grows by half at least, to avoid growing it again for each slightly bigger size
+            grown = np.empty(max(size, len(buffer)*3//2), dtype=dtype)
+            grown[:len(buffer)] = buffer
+            buffer = self._buffers[name] = grown
+        return buffer[:size].reshape(shape)
+
 
 class Camera():
     def __init__(
@@ -32,6 +450,16 @@ class Camera():
         direction=[0, 0, -1],
         orthographic_projection=False,
     ):
+        """A camera that caches its matrices.
+
+        Setting any of its parameters marks the matrices that depend on it as dirty, they are then computed
+        again the next time they are needed. The position and direction are read-only arrays: they must be
+        replaced, not modified in place, for the change to be noticed.
+        """
+        self._view_matrix = None
+        self._projection_matrix = None
+        self._view_projection_matrix = None
+
         self.aspect_ratio = aspect_ratio
         self.fov = fov
         self.near_clipping_plane = near_clipping_plane
@@ -40,20 +468,107 @@ class Camera():
         self.direction = direction
         self.orthographic_projection = orthographic_projection
 
+    def _view_changed(self):
+        self._view_matrix = None
+        self._view_projection_matrix = None
+
+    def _projection_changed(self):
+        self._projection_matrix = None
+        self._view_projection_matrix = None
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = np.array(position, dtype=float)
+        self._position.flags.writeable = False
+        self._view_changed()
+
+    @property
+    def direction(self):
+        return self._direction
+
+    @direction.setter
+    def direction(self, direction):
+        self._direction = np.array(direction, dtype=float)
+        self._direction.flags.writeable = False
+        self._view_changed()
+
+    @property
+    def aspect_ratio(self):
+        return self._aspect_ratio
+
+    @aspect_ratio.setter
+    def aspect_ratio(self, aspect_ratio):
+        self._aspect_ratio = aspect_ratio
+        self._projection_changed()
+
+    @property
+    def fov(self):
+        return self._fov
+
+    @fov.setter
+    def fov(self, fov):
+        self._fov = fov
+        self._projection_changed()
+
+    @property
+    def near_clipping_plane(self):
+        return self._near_clipping_plane
+
+    @near_clipping_plane.setter
+    def near_clipping_plane(self, near_clipping_plane):
+        self._near_clipping_plane = near_clipping_plane
+        self._projection_changed()
+
+    @property
+    def far_clipping_plane(self):
+        return self._far_clipping_plane
+
+    @far_clipping_plane.setter
+    def far_clipping_plane(self, far_clipping_plane):
+        self._far_clipping_plane = far_clipping_plane
+        self._projection_changed()
+
+    @property
+    def orthographic_projection(self):
+        return self._orthographic_projection
+
+    @orthographic_projection.setter
+    def orthographic_projection(self, orthographic_projection):
+        self._orthographic_projection = orthographic_projection
+        self._view_projection_matrix = None
+
     def view_matrix(self):
-        norm_direction = self.direction/np.linalg.norm(self.direction)
-        target = self.position + norm_direction
-        up = np.array([0, 1, 0], dtype=float)
-        camera_matrix = Matrix4x4.point_at(self.position, target, up)
-        return np.linalg.inv(camera_matrix)
+        if self._view_matrix is None:
+            norm_direction = self.direction/np.linalg.norm(self.direction)
+            target = self.position + norm_direction
+            up = np.array([0, 1, 0], dtype=float)
+            camera_matrix = Matrix4x4.point_at(self.position, target, up)
+            # The camera matrix is a rotation and a translation, it can be inverted directly
+            self._view_matrix = Matrix4x4.quick_inverse(camera_matrix)
+        return self._view_matrix
 
     def projection_matrix(self):
-        return Matrix4x4.projection(
-            self.fov,
-            self.aspect_ratio,
-            self.near_clipping_plane,
-            self.far_clipping_plane,
-        )
+        if self._projection_matrix is None:
+            self._projection_matrix = Matrix4x4.projection(
+                self.fov,
+                self.aspect_ratio,
+                self.near_clipping_plane,
+                self.far_clipping_plane,
+            )
+        return self._projection_matrix
+
+    def view_projection_matrix(self):
+        """The view matrix followed by the projection matrix, or only the view matrix in orthographic projection."""
+        if self._view_projection_matrix is None:
+            if self.orthographic_projection:
+                self._view_projection_matrix = self.view_matrix()
+            else:
+                self._view_projection_matrix = self.view_matrix() @ self.projection_matrix()
+        return self._view_projection_matrix
 
 
 class Engine3D():
@@ -68,9 +583,14 @@ class Engine3D():
         camera_direction=[0, 0, -1],
         light_direction=[-1, -2, 0],
         orthographic_projection=False,
+        dtype=np.float64,
     ):
         self.light_direction = light_direction
 
+        # Precision of the computations, the meshes should be created with the same type to avoid conversions
+        self.dtype = np.dtype(dtype)
+        self.scratch = ScratchBuffers(dtype)
+
         self.camera = Camera(
             aspect_ratio,
             fov,
@@ -84,62 +604,551 @@ class Engine3D():
         # Entities list
         self.entities = []
 
+        # Entities stored as arrays, for scenes with many entities
+        self.registry = EntityRegistry()
+
+        # The triangles are always clipped against the near plane, and also against the sides of the screen if enabled
+        self.clip_sides = False
+
+        # Number of entities entirely outside of the view during the last update, they were not drawn.
+        # Each instance of an InstancedEntity counts as an entity.
+        self.culled_entities = 0
+
+        # Meshes with levels of detail are simplified as long as their vertices move by less than this number of
+        # pixels on the screen, see Mesh.build_lods()
+        self.lod_error = 1.0
+
+        # Order of the triangles of the last frame, the next one is usually almost in the same order
+        self._previous_order = None
+
+        # Fingerprint and screen triangles of the entities of the last frame, by identity of the entity
+        self._screen_cache = {}
+
+        # Shade levels of the faces of the meshes used in the last frame, by mesh, rotation and light direction
+        self._lighting_cache = {}
+        self._lighting_used = {}
+
+        # Number of entities whose screen triangles of the last frame were reused during the last update
+        self.cached_entities = 0
+
     def add_entity(self, entity):
         self.entities.append(entity)
 
     def remove_entity(self, entity):
         self.entities.remove(entity)
 
-    def update(self, renderer: Renderer):
+    def raycast(self, origin, direction):
+        """Returns the first entity hit by a ray, see Mesh.raycast(). Instanced and chunked meshes are ignored.
+
+        Args:
+            origin (list): Start of the ray in the world
+            direction (list): Direction of the ray, the distance is measured in lengths of this vector
+
+        Returns:
+            tuple: The distance along the ray, the entity and the index of its triangle, or None if nothing is hit
+        """
+        closest = None
         for entity in self.entities:
-            triangles = entity.mesh
+            if not isinstance(entity, Entity) or not isinstance(entity.mesh, Mesh):
+                continue
+
+            # The ray is moved in the space of the mesh, the distances along it don't change
+            inverse = np.linalg.inv(entity.model_matrix())
+            hit = entity.mesh.raycast(np.append(origin, 1) @ inverse, np.append(direction, 0) @ inverse)
+            if hit is not None and (closest is None or hit[0] < closest[0]):
+                closest = (hit[0], entity, hit[1])
+        return closest
+
+    def _side_planes(self, renderer):
+        """Returns the planes of the edges of the screen, in homogeneous coordinates after projection."""
+        # Once the coordinates are divided by w: left <= x/w <= right and bottom <= y/w <= top
+        left, right, bottom, top = renderer.EXTENT
+        left /= renderer.WIDTH/2
+        right /= renderer.WIDTH/2
+        bottom /= renderer.HEIGHT/2
+        top /= renderer.HEIGHT/2
+        return [[1, 0, 0, -left], [-1, 0, 0, right], [0, 1, 0, -bottom], [0, -1, 0, top]]
+
+    def _clipping_planes(self, renderer):
+        """Returns the planes the triangles are clipped against, in homogeneous coordinates after projection."""
+        planes = []
+
+        # Triangles behind the camera would be divided by a negative w. There is no division in orthographic projection.
+        if not self.camera.orthographic_projection:
+            planes.append([0, 0, 1, 0])
+
+        if self.clip_sides:
+            planes += self._side_planes(renderer)
 
-            # Computing normals
-            line1 = triangles[:, 1, :3] - triangles[:, 0, :3]
-            line2 = triangles[:, 2, :3] - triangles[:, 0, :3]
-            normals = np.cross(line1, line2)
+        return np.array(planes, dtype=float)
+
+    def _culling_planes(self, renderer):
+        """Returns the planes of the view frustum in world space, as unit normals followed by offsets."""
+        planes = self._side_planes(renderer)
+        if not self.camera.orthographic_projection:
+            # Near and far planes: 0 <= z/w <= 1
+            planes += [[0, 0, 1, 0], [0, 0, -1, 1]]
+
+        # A point p is inside a plane after projection if (p @ matrix) @ plane >= 0, i.e. p @ (matrix @ plane) >= 0
+        planes = (self.camera.view_projection_matrix() @ np.array(planes, dtype=float).T).T
+        return planes/np.linalg.norm(planes[:, :3], axis=1)[:, np.newaxis]
+
+    def _to_screen(self, projected_triangles, colors, renderer, clipping_planes, keep_order=False):
+        """Clips projected triangles and converts them to screen coordinates.
+
+        The triangles made by clipping a triangle are put in its place if keep_order is True, otherwise they
+        are at the end.
+
+        Returns:
+            tuple: The screen coordinates of shape (N, 3, 2), the colors, the depths of the vertices after projection
+                of shape (N, 3) and the depths of the triangles in view space of shape (N,)
+        """
+        # The parts of the triangles outside of the view are cut off, the triangles created keep their color.
+        # The triangles clipped by a plane are clipped by the next one, so two sets of buffers alternate.
+        clipped_count = 0
+        for plane in clipping_planes:
+            name = "clipped_%d" % (clipped_count % 2)
+            clipped, source = clip_against_plane(projected_triangles, plane, keep_order, self.scratch, name)
+            if clipped is projected_triangles:
+                continue
+            clipped_count += 1
+            projected_triangles = clipped
+            clipped_colors = self.scratch.get(name + "_colors", (len(source),) + colors.shape[1:], colors.dtype)
+            colors = np.take(colors, source, axis=0, out=clipped_colors, mode='clip')
+
+        # Depth of the triangles in view space: w is the depth before the perspective division
+        coordinate = 2 if self.camera.orthographic_projection else 3
+        view_depths = self.scratch.get("view_depths", (len(projected_triangles),), projected_triangles.dtype)
+        np.add(projected_triangles[:, 0, coordinate], projected_triangles[:, 1, coordinate], out=view_depths)
+        view_depths += projected_triangles[:, 2, coordinate]
+        view_depths /= 3
+
+        # Perspective division, w is copied first so that the division is not done on overlapping arrays
+        w = self.scratch.get("w", (len(projected_triangles), 3, 1), projected_triangles.dtype)
+        np.copyto(w, projected_triangles[:, :, 3:])
+        projected_triangles /= w
+        projected_triangles[:, :, :2] *= np.array([renderer.WIDTH/2, renderer.HEIGHT/2])[np.newaxis, :]
+
+        return projected_triangles[:, :, :2], colors, projected_triangles[:, :, 2], view_depths
+
+    def _cull_instances(self, mesh, models, culling_planes):
+        """Returns the indices of the instances of a mesh whose bounding sphere is not outside of the view."""
+        # The radius is scaled by the largest stretch of the model matrix, the matrices of instances can be any
+        # transformation
+        centers = np.append(mesh.center, 1) @ models
+        radii = mesh.radius*_stretches(models)
+        inside = ~np.any(centers @ culling_planes.T < -radii[:, np.newaxis], axis=1)
+        self.culled_entities += np.count_nonzero(~inside)
+        return np.flatnonzero(inside)
+
+    def _lod_levels(self, mesh, models, renderer):
+        """Returns the level of detail of each instance of a mesh, 0 for the mesh itself, from its size on the screen.
+
+        Args:
+            mesh (Mesh): The mesh of the instances
+            models (ndarray): Model matrices of the instances, of shape (M, 4, 4)
+        """
+        if len(mesh.lods) == 0:
+            return np.zeros(len(models), dtype=np.intp)
+
+        # Size of a pixel at the depth of the center of each instance. In orthographic projection, the view
+        # space is scaled by half the height of the screen.
+        if self.camera.orthographic_projection:
+            pixel_sizes = np.full(len(models), 2/renderer.HEIGHT)
+        else:
+            depths = (np.append(mesh.center, 1) @ models @ self.camera.view_matrix())[:, 2]
+            depths = np.maximum(depths, self.camera.near_clipping_plane)
+            pixel_sizes = 2*depths*np.tan(self.camera.fov*0.5/180.0*np.pi)/renderer.HEIGHT
+
+        # The error allowed is moved in the space of the mesh, which is stretched at most by the model
+        scales = _stretches(models)
+        return np.searchsorted(mesh.lod_cell_sizes, self.lod_error*pixel_sizes/scales, side='right')
+
+    def _add_instances(self, mesh, models, shades, shade_ids, renderer, clipping_planes, frame_size):
+        """Projects instances of a mesh and adds them to the frame, each with the level of detail it needs."""
+        levels = self._lod_levels(mesh, models, renderer)
+        for level in np.unique(levels):
+            group = np.flatnonzero(levels == level)
+            lod = mesh if level == 0 else mesh.lods[level - 1]
+            part = self._project_instances(lod, models[group], shades, shade_ids[group], renderer, clipping_planes)
+            frame_size = self._add_to_frame(part, frame_size)
+        return frame_size
+
+    def _project_instances(self, mesh, models, shades, shade_ids, renderer, clipping_planes):
+        """Projects instances of a mesh all at once, see _to_screen() for the values returned.
+
+        Args:
+            mesh (Mesh): The mesh of the instances
+            models (ndarray): Model matrices of the instances, of shape (M, 4, 4)
+            shades (ndarray): Shade tables, of shape (C, SHADE_LEVELS, 3)
+            shade_ids (ndarray): Index of the shade table of each instance, of shape (M,)
+        """
+        # Backface culling of all the instances at once, in world space
+        normals = mesh.normals @ _normal_matrices(models)
+        if self.camera.orthographic_projection:
+            # All the rays of an orthographic camera are parallel to its direction
+            facing = normals @ self.camera.direction
+        else:
+            first_vertices = mesh.vertices[mesh.faces[:, 0]] @ models
+            camera_rays = first_vertices[:, :, :3] - self.camera.position
+            facing = np.einsum('mfi,mfi->mf', normals, camera_rays)
+        instance, face = np.nonzero(facing < 0)
+
+        # The vertices of each instance are transformed once by its model-view-projection matrix
+        projected_vertices = mesh.vertices @ (models @ self.camera.view_projection_matrix())
+        projected_triangles = projected_vertices[instance[:, np.newaxis], mesh.faces[face]]
+
+        # Shading, the color of each triangle is looked up in the shades of its instance. The shading is skipped
+        # if the rotations of the instances and the light didn't change.
+        face_levels = self._face_levels(mesh, models)
+        if face_levels is not None:
+            levels = face_levels[instance, face]
+        else:
+            normals = normals[instance, face]
             normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+            self.light_direction /= np.linalg.norm(self.light_direction)
+            light_dot_product = normals @ -self.light_direction
+            levels = np.clip(np.rint((light_dot_product + 1)*((SHADE_LEVELS - 1)/2)).astype(int), 0, SHADE_LEVELS - 1)
+        colors = shades[shade_ids[instance], levels]
+
+        return self._to_screen(projected_triangles, colors, renderer, clipping_planes)
+
+    def _project_entity(self, mesh, model, shades, renderer, clipping_planes, culling_planes, frame_size):
+        """Projects the triangles of a mesh placed in the world and adds them to the frame, returns the new frame size.
+
+        Args:
+            mesh (Mesh): The mesh, or one of its levels of detail
+            model (ndarray): Model matrix of shape (4, 4)
+            shades (ndarray): Shades of the color of the mesh, of shape (SHADE_LEVELS, 3)
+        """
+        # The model, view and projection matrices are combined, so that each vertex is multiplied only once
+        model_view_projection = (model @ self.camera.view_projection_matrix()).astype(self.dtype)
+        normal_matrix = _normal_matrices(model).astype(self.dtype)
+
+        # The camera is moved in the space of the mesh for backface culling, which spares transforming the
+        # triangles. With c the normal matrix: (n @ c) . ((v - p) @ m) = |det(m)| n . (v - p)
+        if self.camera.orthographic_projection:
+            # All the rays of an orthographic camera are parallel to its direction
+            camera_direction = (normal_matrix @ self.camera.direction).astype(self.dtype)
+
+            # Its point of view is infinitely far away, opposite to its direction
+            eye = np.append(-self.camera.direction, 0) @ np.linalg.inv(model)
+        else:
+            eye = np.append(self.camera.position, 1) @ np.linalg.inv(model)
+            camera_position = (eye[:3]/eye[3]).astype(self.dtype)
+
+        # Meshes stored in blocks or with a hierarchy only give the triangles in view. The planes are moved in
+        # the space of the mesh: a point p is inside a plane if (p @ model) @ plane >= 0, i.e.
+        # p @ (model @ plane) >= 0
+        object_planes = culling_planes @ model.T
+
+        # Shade levels of all the faces of the mesh, known if the rotation of the entity and the light didn't change.
+        # A chunked mesh is not read as a whole, its levels are kept for each block in view.
+        chunked = isinstance(mesh, ChunkedMesh)
+        face_levels = None if chunked else self._face_levels(mesh, model[np.newaxis])
+
+        # The triangles of a mesh with a BSP tree come from back to front, they are kept in this order
+        for vertices, faces, normals, indices in mesh.visible_parts(object_planes, eye):
+            # The stages write in the scratch buffers of the engine, only the triangles of the frame are kept
+            scratch = self.scratch
+
+            if chunked:
+                part_levels = self._face_levels(mesh, model[np.newaxis], normals, (indices.start, indices.stop))
+            else:
+                part_levels = None if face_levels is None else face_levels[:, indices]
 
             # Calculate dot product of normal and camera ray for all triangles
-            camera_rays = triangles[:, 0, :3] - self.camera.position
+            visibility_dot_products = scratch.get("visibility", (len(faces),))
+            if self.camera.orthographic_projection:
+                np.matmul(normals, camera_direction, out=visibility_dot_products, casting='same_kind')
+            else:
+                first_vertices = scratch.get("rays", (len(faces), 4), vertices.dtype)
+                np.take(vertices, faces[:, 0], axis=0, out=first_vertices, mode='clip')
+                camera_rays = np.subtract(first_vertices[:, :3], camera_position, out=first_vertices[:, :3], casting='same_kind')
 
-            # Dark stackoverflow magic to simply perform a dot product
-            # (Source: https://stackoverflow.com/questions/63301019/dot-product-of-two-numpy-arrays-with-3d-vectors)
-            visibility_dot_products = np.einsum('ij,ij->i', normals, camera_rays)
+                # Dark stackoverflow magic to simply perform a dot product
+                # (Source: https://stackoverflow.com/questions/63301019/dot-product-of-two-numpy-arrays-with-3d-vectors)
+                np.einsum('ij,ij->i', normals, camera_rays, out=visibility_dot_products, casting='same_kind')
 
             # Filter out triangles that are not visible
-            visible_triangles = triangles[visibility_dot_products < 0]
+            visible = np.less(visibility_dot_products, 0, out=scratch.get("visible", (len(faces),), bool))
+            visible = np.flatnonzero(visible)
+            count = len(visible)
+            mesh_faces = scratch.get("mesh_faces", (count, 3), faces.dtype)
+            np.take(faces, visible, axis=0, out=mesh_faces, mode='clip')
 
-            # Translation
-            translated_triangles = visible_triangles @ entity.translation_matrix()
+            # The indices are converted to the native integer type, np.take would copy them otherwise
+            visible_faces = scratch.get("faces", (count, 3), np.intp)
+            np.copyto(visible_faces, mesh_faces)
 
-            # We move the triangles in front of the camera
-            viewed_triangles = translated_triangles @ self.camera.view_matrix()
+            # We place the vertices in the world, move them in front of the camera and project them: we "squish"
+            # them onto the screen. Each vertex is transformed once even if it is shared by several triangles.
+            projected_vertices = scratch.get("vertices", (len(vertices), 4))
+            np.matmul(vertices, model_view_projection, out=projected_vertices, casting='same_kind')
 
-            # Alignment of the triangles normals with the light
-            self.light_direction /= np.linalg.norm(self.light_direction)
-            light_dot_product = np.dot(-self.light_direction, normals[visibility_dot_products < 0].T)
+            # The projected vertices of the visible triangles are gathered, they can then be modified
+            projected_triangles = scratch.get("triangles", (count, 3, 4))
+            np.take(projected_vertices, visible_faces, axis=0, out=projected_triangles, mode='clip')
+
+            if part_levels is not None:
+                # The shading is skipped, the levels of the visible triangles are looked up
+                levels = scratch.get("cached_levels", (count,), np.uint8)
+                np.take(part_levels[0], visible, out=levels, mode='clip')
+            else:
+                # Alignment of the triangles normals with the light, in world space
+                visible_normals = scratch.get("normals", (count, 3), normals.dtype)
+                np.take(normals, visible, axis=0, out=visible_normals, mode='clip')
+                world_normals = scratch.get("world_normals", (count, 3))
+                np.matmul(visible_normals, normal_matrix, out=world_normals, casting='same_kind')
+                self.light_direction /= np.linalg.norm(self.light_direction)
+                light_dot_product = scratch.get("light", (count,))
+                np.matmul(world_normals, -self.light_direction.astype(self.dtype), out=light_dot_product)
+                lengths = np.einsum('ij,ij->i', world_normals, world_normals, out=scratch.get("lengths", (count,)))
+                light_dot_product /= np.sqrt(lengths, out=lengths)
+
+                light_dot_product += 1
+                light_dot_product *= (SHADE_LEVELS - 1)/2
+                np.clip(np.rint(light_dot_product, out=light_dot_product), 0, SHADE_LEVELS - 1, out=light_dot_product)
+                levels = scratch.get("levels", (count,), np.intp)
+                np.copyto(levels, light_dot_product, casting='unsafe')
+
+            # The color of each triangle is looked up in the shades of the entity
+            colors = scratch.get("colors", (count, 3), shades.dtype)
+            np.take(shades, levels, axis=0, out=colors, mode='clip')
+
+            part = self._to_screen(projected_triangles, colors, renderer, clipping_planes, mesh.bsp is not None)
+            frame_size = self._add_to_frame(part, frame_size)
+        return frame_size
+
+    def _project_registry(self, renderer, clipping_planes, culling_planes, frame_size):
+        """Transforms, culls and projects all the entities of the registry, one batch per mesh."""
+        registry = self.registry
+        if len(registry) == 0:
+            return frame_size
+
+        models = registry.model_matrices()
+
+        # Bounding spheres of all the entities, the hidden entities are not counted as culled
+        meshes = registry.meshes
+        centers = np.array([np.append(mesh.center, 1) for mesh in meshes])[registry.mesh_ids]
+        radii = np.array([mesh.radius for mesh in meshes])[registry.mesh_ids]
+        centers = np.einsum('mi,mij->mj', centers, models)
+        radii = radii*_stretches(models)
+        inside = ~np.any(centers @ culling_planes.T < -radii[:, np.newaxis], axis=1)
+        self.culled_entities += np.count_nonzero(~inside & registry.visible)
+        drawn = np.flatnonzero(inside & registry.visible)
+
+        # The entities are grouped by mesh, each group is projected as instances of its mesh
+        drawn = drawn[np.argsort(registry.mesh_ids[drawn], kind='stable')]
+        mesh_ids, starts = np.unique(registry.mesh_ids[drawn], return_index=True)
+        for mesh_id, group in zip(mesh_ids, np.split(drawn, starts[1:])):
+            frame_size = self._add_instances(
+                meshes[mesh_id],
+                models[group],
+                registry.shades,
+                registry.shade_ids[group],
+                renderer,
+                clipping_planes,
+                frame_size,
+            )
+        return frame_size
+
+    def update(self, renderer: Renderer):
+        # The triangles of all the entities are gathered in the scratch buffers of the frame, then sorted and sent
+        # to the renderer in one batch. Each entity or block of a mesh is added as a part, see _to_screen().
+        frame_size = 0
+
+        clipping_planes = self._clipping_planes(renderer)
+        culling_planes = self._culling_planes(renderer)
+        self.culled_entities = 0
+        self.cached_entities = 0
+
+        # Depth and range in the frame of the parts whose triangles are already drawn from back to front
+        ordered_parts = []
 
-            # Can be greatly optimized by adjusting lightness manually
-            colors = np.empty((viewed_triangles.shape[0], 3))
-            for i in range(viewed_triangles.shape[0]):
-                colors[i] = np.array(self.adjust_lightness(entity.color, (light_dot_product[i] + 1)/2.5))
+        # Only the entities and the lighting of this frame are kept in the caches
+        screen_cache = {}
+        self._lighting_used = {}
 
-            # We project the triangles: we "squish" them triangles onto the screen
-            if not self.camera.orthographic_projection:
-                projected_triangles = viewed_triangles @ self.camera.projection_matrix()
+        for entity in self.entities:
+            if isinstance(entity, InstancedEntity):
+                # The instances are cached together, only the ones not outside of the view are projected
+                mesh = entity.mesh
+                model = entity.model_matrices
+                instances = self._cull_instances(mesh, model, culling_planes)
+            else:
+                # Entities whose bounding sphere is entirely outside of one of the planes of the view are skipped
+                center, radius = entity.bounding_sphere()
+                if np.any(culling_planes[:, :3] @ center + culling_planes[:, 3] < -radius):
+                    self.culled_entities += 1
+                    continue
+
+                model = entity.model_matrix()
+
+                # Entities far from the camera are drawn with a simplified mesh
+                mesh = entity.mesh
+                level = self._lod_levels(mesh, model[np.newaxis], renderer)[0]
+                if level > 0:
+                    mesh = mesh.lods[level - 1]
+
+            # Entities that didn't change since the last frame, seen by the same camera, are not projected again.
+            # Their screen triangles are only kept once they are seen unchanged twice, so that the entities that
+            # move are not copied at each frame.
+            fingerprint, pinned = self._fingerprint(entity, mesh, model, renderer)
+            cached = self._screen_cache.get(id(entity))
+            unchanged = cached is not None and cached[0] == fingerprint
+            part = cached[2] if unchanged else None
+            start = frame_size
+            if part is not None:
+                frame_size = self._add_to_frame(part, frame_size)
+                self.cached_entities += 1
+            else:
+                if isinstance(entity, InstancedEntity):
+                    frame_size = self._add_instances(
+                        mesh,
+                        model[instances],
+                        entity.shades,
+                        entity.shade_ids[instances],
+                        renderer,
+                        clipping_planes,
+                        frame_size,
+                    )
+                else:
+                    frame_size = self._project_entity(
+                        mesh, model, entity.shades, renderer, clipping_planes, culling_planes, frame_size
+                    )
+                if unchanged:
+                    part = tuple(buffer[start:frame_size].copy() for buffer in self._frame_buffers(frame_size))
+            screen_cache[id(entity)] = (fingerprint, pinned, part)
+
+            if not isinstance(entity, InstancedEntity) and mesh.bsp is not None:
+                ordered_parts.append(((np.append(center, 1) @ self.camera.view_matrix())[2], start, frame_size))
+
+        self._screen_cache = screen_cache
+        frame_size = self._project_registry(renderer, clipping_planes, culling_planes, frame_size)
+        self._lighting_cache = self._lighting_used
+
+        if frame_size == 0:
+            return
+
+        triangles, colors, depths, view_depths = self._frame_buffers(frame_size)
+
+        # Painter's algorithm: the triangles are drawn from the farthest to the closest.
+        # The raster backend has a depth buffer, so the order doesn't matter.
+        if renderer.BACKEND != "raster":
+            # The order is copied in a contiguous buffer, np.take copies the indices it is given otherwise
+            order = self.scratch.get("order", (frame_size,), np.intp)
+            if sum(end - start for _, start, end in ordered_parts) == frame_size:
+                # All the parts are in order, only the parts are sorted by the depth of their entity
+                ordered_parts.sort(reverse=True)
+                np.copyto(order, np.concatenate([np.arange(start, end) for _, start, end in ordered_parts]))
             else:
-                projected_triangles = viewed_triangles
+                np.copyto(order, self._depth_order(view_depths))
+            triangles = np.take(triangles, order, axis=0, out=self.scratch.get("sorted_triangles", triangles.shape), mode='clip')
+            colors = np.take(colors, order, axis=0, out=self.scratch.get("sorted_colors", colors.shape), mode='clip')
+            depths = np.take(depths, order, axis=0, out=self.scratch.get("sorted_depths", depths.shape), mode='clip')
+
+        # The arrays are views on the scratch buffers, the renderer must not keep them after the next update
+        renderer.filled_triangles(triangles, colors, depths)
+
+    def _face_levels(self, mesh, models, normals=None, part=None):
+        """Returns the shade levels of all the faces of instances of a mesh, of shape (M, N), or None.
+
+        The levels only depend on the rotation and scale of the instances and on the light, not on their position
+        nor on the camera, so they are kept for the entities that only move. They are computed once the same
+        rotations and light are seen in two frames in a row. Before, None is returned and the levels are
+        computed for the triangles drawn only.
+
+        Args:
+            mesh (Mesh): The mesh of the instances
+            models (ndarray): Model matrices of the instances, of shape (M, 4, 4)
+            normals (ndarray): Normals of the faces of a part of the mesh only, of shape (N, 3)
+            part (tuple): Range of the faces of this part in the mesh, which identifies it
+        """
+        light_direction = np.asarray(self.light_direction, dtype=float)
+        light_direction = light_direction/np.linalg.norm(light_direction)
+        key = (id(mesh), id(mesh.normals), part, models[:, :3, :3].tobytes(), light_direction.tobytes())
+
+        # The mesh and its normals are kept with the levels, so that their identity is not reused
+        levels = None
+        if key in self._lighting_cache:
+            levels = self._lighting_cache[key][1]
+            if levels is None:
+                normals = mesh.normals if normals is None else normals
+                world_normals = np.asarray(normals) @ _normal_matrices(models)
+                light_dot_product = (world_normals @ -light_direction)/np.linalg.norm(world_normals, axis=2)
+                levels = np.rint((light_dot_product + 1)*((SHADE_LEVELS - 1)/2))
+                levels = np.clip(levels, 0, SHADE_LEVELS - 1).astype(np.uint8)
+        self._lighting_used[key] = ((mesh, mesh.normals), levels)
+        return levels
+
+    def _frame_buffers(self, frame_size):
+        """Returns the triangles, colors, depths and view depths of the frame in the scratch buffers."""
+        return (
+            self.scratch.get("frame_triangles", (frame_size, 3, 2)),
+            self.scratch.get("frame_colors", (frame_size, 3)),
+            self.scratch.get("frame_depths", (frame_size, 3)),
+            self.scratch.get("frame_view_depths", (frame_size,)),
+        )
+
+    def _fingerprint(self, entity, mesh, model, renderer):
+        """Returns what the screen triangles of an entity depend on, and the objects it refers to.
+
+        The arrays of a mesh and the shades of a color are replaced, not modified, when they change, so they are
+        compared by identity. The objects are returned to be kept with the fingerprint, their identity can't be
+        reused by new objects while they exist. For an InstancedEntity, model holds the model matrices of all
+        the instances, whose levels of detail also depend on the levels of the mesh and on the error allowed.
+        """
+        light_direction = np.asarray(self.light_direction, dtype=float)
+        vertices = getattr(mesh, "vertices", None)
+        lod_cell_sizes = getattr(mesh, "lod_cell_sizes", None)
+        fingerprint = (
+            model.tobytes(),
+            id(lod_cell_sizes),
+            self.lod_error,
+            self.camera.view_projection_matrix().tobytes(),
+            self.camera.orthographic_projection,
+            (light_direction/np.linalg.norm(light_direction)).tobytes(),
+            renderer.WIDTH,
+            renderer.HEIGHT,
+            self.clip_sides,
+            self.dtype,
+            id(mesh),
+            id(vertices),
+            id(entity.shades),
+        )
+        return fingerprint, (entity, mesh, vertices, lod_cell_sizes, entity.shades)
+
+    def _add_to_frame(self, part, frame_size):
+        """Copies the screen triangles of a part at the end of the triangles of the frame, returns the new frame size."""
+        triangles, colors, depths, view_depths = part
+        end = frame_size + len(triangles)
+        self.scratch.get("frame_triangles", (end, 3, 2))[frame_size:] = triangles
+        self.scratch.get("frame_colors", (end, 3))[frame_size:] = colors[:, :3]
+        self.scratch.get("frame_depths", (end, 3))[frame_size:] = depths
+        self.scratch.get("frame_view_depths", (end,))[frame_size:] = view_depths
+        return end
 
-            projected_triangles[:, 0] /= projected_triangles[:, 0][:, np.newaxis, -1]
-            projected_triangles[:, 1] /= projected_triangles[:, 1][:, np.newaxis, -1]
-            projected_triangles[:, 2] /= projected_triangles[:, 2][:, np.newaxis, -1]
-            projected_triangles[:, :, :2] *= np.array([renderer.WIDTH/2, renderer.HEIGHT/2])[np.newaxis, :]
+    def _depth_order(self, view_depths):
+        """Returns the order in which the triangles must be drawn, from the farthest to the closest.
 
-            for i in range(projected_triangles.shape[0]):
-                t = projected_triangles[i]
-                renderer.filled_triangle(t[0, 0], t[0, 1], t[1, 0], t[1, 1], t[2, 0], t[2, 1], color=colors[i])
+        When the frame has as many triangles as the previous one, they are most likely the same triangles
+        that barely moved. Their depths are taken in the previous order and, if few pairs are out of order,
+        this order is repaired by a stable sort, which is fast on data that is almost sorted. Otherwise the
+        triangles are sorted from scratch.
+        """
+        # The order is kept from the closest to the farthest, and reversed when it is returned
+        previous = self._previous_order
+        if previous is not None and len(previous) == len(view_depths):
+            depths = self.scratch.get("previous_depths", (len(previous),))
+            np.take(view_depths, previous, out=depths, mode='clip')
+            out_of_order = self.scratch.get("out_of_order", (len(previous) - 1,), bool)
+            inversions = np.count_nonzero(np.less(depths[1:], depths[:-1], out=out_of_order))
+            if inversions == 0:
+                return previous[::-1]
+            if inversions <= RESORT_RATIO*len(previous):
+                self._previous_order = previous[np.argsort(depths, kind='stable')]
+                return self._previous_order[::-1]
 
-    def adjust_lightness(self, color, amount=0.5):
-        color_hls = colorsys.rgb_to_hls(*mc.to_rgb(color))
-        return colorsys.hls_to_rgb(color_hls[0], max(0, min(1, amount*color_hls[1])), color_hls[2])
+        self._previous_order = np.argsort(view_depths)
+        return self._previous_order[::-1]
@@ -1,7 +1,12 @@
 from enum import IntEnum
 from matplotlib.backend_bases import MouseButton
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
 from matplotlib.patches import Ellipse
+from rasterizer import Framebuffer
 
 
 class Renderer:
@@ -10,22 +15,112 @@ class Renderer:
         MIDDLE = 2
         RIGHT = 3
 
-    def __init__(self, width=10, height=10, frame_time=1/60):
-        """A class that abstracts the rendering engine"""
+    def __init__(self, width=10, height=10, frame_time=1/60, retained=False, backend="vector", headless=False):
+        """A class that abstracts the rendering engine
+
+        In retained mode, the axes are only set up once. The triangles live in a persistent collection
+        that is updated in place every frame, and the frame is redrawn by blitting over a cached background.
+
+        With the "raster" backend, the triangles are not drawn as matplotlib polygons but rasterized
+        with a depth buffer into an image, which is displayed with a single imshow.
+
+        In headless mode, the scene is rendered off-screen on an Agg canvas: no window is opened
+        and no input is listened to. Frames are retrieved as arrays with render_frame().
+        """
         self.WIDTH = width
         self.HEIGHT = height
         self.FRAME_TIME = frame_time
+        self.RETAINED = retained
+        self.BACKEND = backend
+        self.HEADLESS = headless
 
-        self.fig, self.axes = plt.subplots()
+        # Area of the screen shown by the axes (left, right, bottom, top)
+        self.EXTENT = (-200, self.WIDTH, -200, self.HEIGHT)
+
+        if self.HEADLESS:
+            # The figure is not managed by pyplot, so it never opens a window
+            self.fig = Figure()
+            FigureCanvasAgg(self.fig)
+            self.axes = self.fig.add_subplot()
+        else:
+            self.fig, self.axes = plt.subplots()
         self._set_axis()
         self._setup_inputs()
+        if self.BACKEND == "raster":
+            self._setup_raster()
+        if self.RETAINED:
+            self._setup_retained()
 
     def _set_axis(self):
-        self.axes.set_xlim(-200, self.WIDTH)
-        self.axes.set_ylim(-200, self.HEIGHT)
+        self.axes.set_xlim(self.EXTENT[0], self.EXTENT[1])
+        self.axes.set_ylim(self.EXTENT[2], self.EXTENT[3])
         self.axes.set_title("Stacker")
         self.axes.set_aspect("equal", "box")
 
+    def _setup_raster(self):
+        # The framebuffer covers the whole axes, with one pixel per unit
+        left, right, bottom, top = self.EXTENT
+        self.framebuffer = Framebuffer(int(right - left), int(top - bottom), self.EXTENT)
+        self._create_image()
+
+    def _create_image(self):
+        self._image = self.axes.imshow(
+            self.framebuffer.color,
+            extent=self.framebuffer.EXTENT,
+            origin="lower",
+            interpolation="nearest",
+            animated=self.RETAINED,
+        )
+
+    def _setup_retained(self):
+        # Animated artists are left out of canvas.draw(), so they never end up in the cached background
+        if self.BACKEND == "raster":
+            self._persistent = [self._image]
+        else:
+            self._triangles = PolyCollection([], animated=True)
+            self.axes.add_collection(self._triangles, autolim=False)
+            self._persistent = [self._triangles]
+        self._frame_verts = []
+        self._frame_colors = []
+
+        # Artists created by the other drawing functions, they only live for one frame
+        self._transients = []
+
+        # The background has to be captured again every time the whole figure is redrawn (e.g. when resized)
+        self._background = None
+        self.fig.canvas.mpl_connect("draw_event", self._on_draw)
+        if not self.HEADLESS:
+            plt.show(block=False)
+
+    def _on_draw(self, event):
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self._persistent + self._transients:
+            self.axes.draw_artist(artist)
+
+    def _update_triangles(self):
+        """Moves the triangles submitted during this frame into the persistent collection."""
+        if self._frame_verts:
+            verts = np.concatenate(self._frame_verts)
+            colors = np.concatenate(self._frame_colors)
+        else:
+            verts = np.empty((0, 3, 2))
+            colors = np.empty((0, 4))
+        self._triangles.set_verts(verts)
+        self._triangles.set_facecolor(colors)
+        self._triangles.set_edgecolor(colors)
+        self._frame_verts = []
+        self._frame_colors = []
+
+    def _track(self, *artists):
+        """Registers artists that must be removed after the next frame in retained mode."""
+        if self.RETAINED:
+            for artist in artists:
+                artist.set_animated(True)
+                self._transients.append(artist)
+
     def _setup_inputs(self):
         self._buttons_pressed = []
         self.mouse_x = 0
@@ -34,6 +129,8 @@ class Renderer:
         self.prev_mouse_y = self.mouse_y
         self.mouse_delta_x = self.mouse_x - self.prev_mouse_x
         self.mouse_delta_y = self.mouse_y - self.prev_mouse_y
+        if self.HEADLESS:
+            return
         for param in plt.rcParams.find_all("keymap"):
             plt.rcParams[param] = []
         plt.connect('motion_notify_event', self._mouse_moved)
@@ -67,53 +164,127 @@ class Renderer:
 
     def draw(self):
         """Renders the scene."""
-        plt.pause(0.000000000000000000000000000000000000000000000001)
-        # plt.pause(self.FRAME_TIME)
-        self.axes.cla()
-        self._set_axis()
+        self._flush()
+        if self.HEADLESS:
+            self._draw_canvas()
+        elif self.RETAINED:
+            self._draw_canvas()
+            self.fig.canvas.blit(self.fig.bbox)
+            self.fig.canvas.flush_events()
+        else:
+            plt.pause(0.000000000000000000000000000000000000000000000001)
+            # plt.pause(self.FRAME_TIME)
+        self._next_frame()
+
+    def render_frame(self):
+        """Renders the scene and returns it as an RGBA array of shape (height, width, 4).
+
+        The array is a view on the canvas buffer, without any copy: its content is only valid until
+        the next frame is rendered, it must be copied to be kept.
+        """
+        self._flush()
+        self._draw_canvas()
+        frame = np.asarray(self.fig.canvas.buffer_rgba())
+        self._next_frame()
+        return frame
+
+    def _flush(self):
+        """Hands what was submitted during this frame to the persistent artists."""
+        if self.BACKEND == "raster":
+            self._image.set_data(self.framebuffer.color)
+        elif self.RETAINED:
+            self._update_triangles()
+
+    def _draw_canvas(self):
+        canvas = self.fig.canvas
+        if self.RETAINED and self._background is not None:
+            canvas.restore_region(self._background)
+            self._draw_animated()
+        else:
+            # The whole figure is drawn, in retained mode this also captures the background
+            canvas.draw()
+
+    def _next_frame(self):
+        """Clears what was drawn during this frame."""
+        if self.RETAINED:
+            for artist in self._transients:
+                artist.remove()
+            self._transients = []
+        else:
+            self.axes.cla()
+            self._set_axis()
+            if self.BACKEND == "raster":
+                self._create_image()
+
+        if self.BACKEND == "raster":
+            self.framebuffer.clear()
 
     def point(self, x, y, color="orange"):
         """Sets the point (x, y) to the character char."""
-        self.axes.plot(x, y, ".", color=color)
+        self._track(*self.axes.plot(x, y, ".", color=color))
 
     def line(self, x1, y1, x2, y2, width=2, color="orange"):
         """Draws a line between the two points (x1, y1) (x2, y2)."""
-        self.axes.plot([x1, x2], [y1, y2], color=color, linewidth=width)
+        self._track(*self.axes.plot([x1, x2], [y1, y2], color=color, linewidth=width))
 
     def text(self, x, y, s, color="orange"):
         """Write the text s starting at the x, y location on the screen."""
-        self.axes.text(x, y, s, color=color)
+        self._track(self.axes.text(x, y, s, color=color))
 
     def rect(self, x, y, w, h, color="orange", width=2):
         """Draws a rectangle whose bottom left corner is at (x, y) and of width w and height h."""
         X = [x, x, x + w, x + w, x]
         Y = [y, y + h, y + h, y, y]
-        self.axes.plot(X, Y, color=color, lw=width)
+        self._track(*self.axes.plot(X, Y, color=color, lw=width))
 
     def filled_rect(self, x, y, w, h, color="orange"):
         """Draws a filled rectangle whose bottom left corner is at (x, y) and of width w and height h."""
         X = [x, x, x + w, x + w]
         Y = [y, y + h, y + h, y]
-        self.axes.fill(X, Y, color=color)
+        self._track(*self.axes.fill(X, Y, color=color))
 
     def ellipse(self, x, y, w, h, color="orange", width=2):
         """Draws an ellipse of center (x, y) and of width h and height h."""
         ellipse = Ellipse((x, y), w, h, facecolor="none", edgecolor=color, linewidth=width)
-        self.axes.add_artist(ellipse)
+        self._track(self.axes.add_artist(ellipse))
 
     def filled_ellipse(self, x, y, w, h, color="orange"):
         """Draws a filled ellipse of center (x, y) and of width h and height h."""
         ellipse = Ellipse((x, y), w, h, color=color)
-        self.axes.add_artist(ellipse)
+        self._track(self.axes.add_artist(ellipse))
 
     def triangle(self, x1, y1, x2, y2, x3, y3, color="orange", width=2):
         """Draws a triangle from 3 points"""
         X = [x1, x2, x3, x1]
         Y = [y1, y2, y3, y1]
-        self.axes.plot(X, Y, color=color, lw=width)
+        self._track(*self.axes.plot(X, Y, color=color, lw=width))
 
     def filled_triangle(self, x1, y1, x2, y2, x3, y3, color="orange"):
         """Draws a filled triangle from 3 points"""
         X = [x1, x2, x3]
         Y = [y1, y2, y3]
-        self.axes.fill(X, Y, color=color)
+        self._track(*self.axes.fill(X, Y, color=color))
+
+    def filled_triangles(self, verts, colors, depths=None):
+        """Draws many filled triangles at once, using a single artist.
+
+        Args:
+            verts (ndarray): Screen coordinates of the triangles, of shape (N, 3, 2)
+            colors (ndarray): RGB or RGBA colors of the triangles, of shape (N, 3) or (N, 4)
+            depths (ndarray): Depth of each vertex, of shape (N, 3), smaller is closer.
+                Only used by the raster backend, the vector backend draws the triangles in order.
+        """
+        if self.BACKEND == "raster":
+            self.framebuffer.triangles(verts, colors, depths)
+            return
+
+        if self.RETAINED:
+            self._frame_verts.append(verts)
+            self._frame_colors.append(colors)
+            return
+
+        if len(verts) == 0:
+            return
+        # Same look as axes.fill: the edges are drawn with the face color to hide the seams
+        triangles = PolyCollection(verts, facecolors=colors, edgecolors=colors)
+        self.axes.add_collection(triangles, autolim=False)
@@ -5,7 +5,9 @@ A simple stacker game
 
 import math
 from renderer import Renderer
-from engine import Engine3D, Entity
+from engine import Engine3D, InstancedEntity
+from matrix import Matrix4x4
+from mesh import Mesh
 import colorsys
 import numpy as np
 import keyboard
@@ -32,6 +34,7 @@ class Stacker():
             width=200,
             height=200,
             frame_time=0,
+            retained=True,
         )
 
         # The 3D Engine can draw more advance 3 dimensional entities, like cubes, 3d models, icospheres, ...
@@ -54,8 +57,14 @@ class Stacker():
         self.platform_depth = 1
         self.platform_rest_position = np.zeros(3)
 
-        # Preparing the stack
-        self.platforms = []
+        # Preparing the stack. All the platforms are instances of the same box, each with its own size, position and color.
+        # The moving platform is apart from the tower, so that the tower is not projected again at each frame
+        # while the camera doesn't move.
+        box = self.create_box_mesh()
+        self.tower = InstancedEntity(mesh=box)
+        self.platform = InstancedEntity(mesh=box)
+        self.engine3d.add_entity(self.tower)
+        self.engine3d.add_entity(self.platform)
         for i in range(11):
             self.drop_platform()
 
@@ -64,26 +73,17 @@ class Stacker():
         self.space_already_pressed = False
         self.gameover = False
 
-    def create_box(self, x, y, z, w, h, d):
-        """Return a box entity.
-        Takes the position of the back lower left vertex and the width, height and depth of the box.
-
-        Args:
-            x (float): X coordinate
-            y (float): Y coordinate
-            z (float): Z coordinate
-            w (float): Width
-            h (float): Height
-            d (float): Depth
+    def create_box_mesh(self):
+        """Return the mesh of a box of size 1, whose back lower left vertex is at the origin.
         """
         p1 = [0, 0, 0]
-        p2 = [w, 0, 0]
-        p3 = [0, h, 0]
-        p4 = [w, h, 0]
-        p5 = [0, 0, d]
-        p6 = [w, 0, d]
-        p7 = [0, h, d]
-        p8 = [w, h, d]
+        p2 = [1, 0, 0]
+        p3 = [0, 1, 0]
+        p4 = [1, 1, 0]
+        p5 = [0, 0, 1]
+        p6 = [1, 0, 1]
+        p7 = [0, 1, 1]
+        p8 = [1, 1, 1]
         mesh = [
             # Face de devant
             [p1, p3, p4],
@@ -104,16 +104,35 @@ class Stacker():
             [p6, p5, p1],
             [p6, p1, p2],
         ]
-        cube = Entity(mesh=mesh, position=[x, y, z])
-        return cube
+        return Mesh(mesh)
+
+    def create_box(self, x, y, z, w, h, d):
+        """Return the model matrix of a box instance.
+        Takes the position of the back lower left vertex and the width, height and depth of the box.
+
+        Args:
+            x (float): X coordinate
+            y (float): Y coordinate
+            z (float): Z coordinate
+            w (float): Width
+            h (float): Height
+            d (float): Depth
+        """
+        return Matrix4x4.scaling(w, h, d) @ Matrix4x4.translation(x, y, z)
+
+    def platform_position(self):
+        """Return the position of the back lower left vertex of the moving platform, as a view on its model matrix.
+        """
+        return self.platform.model_matrices[0, 3, :3]
 
     def drop_platform(self):
         """Drop a platform on the one below it and resize itself to fit on it.
         """
-        if len(self.platforms) > 0:
+        if len(self.platform) > 0:
             # The part of the plateform on the tower.
-            self.platform_width = self.platform_width - abs(self.platforms[-1].position[0] - self.platform_rest_position[0])
-            self.platform_depth = self.platform_depth - abs(self.platforms[-1].position[2] - self.platform_rest_position[2])
+            top_position = self.platform_position()
+            self.platform_width = self.platform_width - abs(top_position[0] - self.platform_rest_position[0])
+            self.platform_depth = self.platform_depth - abs(top_position[2] - self.platform_rest_position[2])
 
             # If we are no longer on the tower, we lost!
             if self.platform_width < 0 or self.platform_depth < 0:
@@ -122,21 +141,20 @@ class Stacker():
                 return
 
             # Changing the resting position if we are in the negatives
-            if self.platforms[-1].position[0] > self.platform_rest_position[0]:
-                self.platform_rest_position[0] = self.platforms[-1].position[0]
-            if self.platforms[-1].position[2] > self.platform_rest_position[2]:
-                self.platform_rest_position[2] = self.platforms[-1].position[2]
+            if top_position[0] > self.platform_rest_position[0]:
+                self.platform_rest_position[0] = top_position[0]
+            if top_position[2] > self.platform_rest_position[2]:
+                self.platform_rest_position[2] = top_position[2]
 
-            # Recreating a platform with the correct size
-            self.engine3d.remove_entity(self.platforms[-1])
-            self.platforms.remove(self.platforms[-1])
-            self.add_platform()
+            # Recreating a platform with the correct size on the tower
+            self.platform.remove_instances(0)
+            self.add_platform(self.tower)
 
             # The stack is growing!
             self.platform_rest_position[1] += 0.2
 
         # The new moving platform
-        self.add_platform()
+        self.add_platform(self.platform)
 
         # We reset the time of the cosinus, so the platform is far from the tower
         self.time = 0
@@ -147,18 +165,17 @@ class Stacker():
         # We rotate the direction in which the platform is moving by 90 degrees
         self.direction = np.array([-self.direction[2], 0, self.direction[0]])
 
-    def add_platform(self):
-        """Add a platform to our list of platforms and to the 3d engine.
+    def add_platform(self, platforms):
+        """Add a platform to the instances of the tower or of the moving platform.
         """
         # We create a box of the correct shape and size
         platform = self.create_box(self.platform_rest_position[0], self.platform_rest_position[1], self.platform_rest_position[2], self.platform_width, 0.2, self.platform_depth)
 
         # By changing color space, we can change the hue of our color instead of the raw RGB values.
-        platform.color = colorsys.hsv_to_rgb((len(self.platforms) % 100)/100, 1, 1)
+        color = colorsys.hsv_to_rgb((len(self.tower) % 100)/100, 1, 1)
 
-        # We add our platform to our list of platforms and to the 3d engine
-        self.platforms.append(platform)
-        self.engine3d.add_entity(platform)
+        # We add our platform to the instances drawn by the 3d engine
+        platforms.add_instance(platform, color)
 
     def run(self):
         """The main loop of the game
@@ -181,18 +198,15 @@ class Stacker():
 
                 # We animate the top platform
                 self.time += 1/30
-                self.platforms[-1].position = self.platform_rest_position + math.cos(self.time)*self.direction
+                self.platform_position()[:] = self.platform_rest_position + math.cos(self.time)*self.direction
 
                 # We destroy platform that are too low to be visible
-                for platform in self.platforms:
-                    if platform.position[1] < self.engine3d.camera.position[1] - 5:
-                        self.platforms.remove(platform)
-                        self.engine3d.remove_entity(platform)
+                too_low = self.tower.model_matrices[:, 3, 1] < self.engine3d.camera.position[1] - 5
+                if too_low.any():
+                    self.tower.remove_instances(np.flatnonzero(too_low))
 
             # We smoothly move the camera to its target
-            self.engine3d.camera.position[0] = lerp(self.engine3d.camera.position[0], self.camera_target_pos[0], 0.1)
-            self.engine3d.camera.position[1] = lerp(self.engine3d.camera.position[1], self.camera_target_pos[1], 0.1)
-            self.engine3d.camera.position[2] = lerp(self.engine3d.camera.position[2], self.camera_target_pos[2], 0.1)
+            self.engine3d.camera.position = lerp(self.engine3d.camera.position, self.camera_target_pos, 0.1)
 
             # We update the 3d engine and render the scene.
             self.engine3d.update(self.renderer)